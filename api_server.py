@@ -0,0 +1,290 @@
+import argparse  # command line options
+import asyncio  # the server handles many requests per process on one event loop
+import json  # request and response bodies
+import math  # rejecting wait=nan / inf
+import multiprocessing  # several worker processes sharing the port
+import os  # worker process ids in /health
+import sys  # exit code
+from concurrent.futures import ThreadPoolExecutor  # runs the blocking generation core
+from dataclasses import asdict  # GenerationResult as JSON
+
+from aiohttp import web  # async HTTP server
+
+import email_generator  # same generation core, cache, history and feedback store as the Streamlit app
+from job_queue import PENDING, QueueFull, get_queue  # outbox jobs
+from llm_backend import use_connection_pool  # keep-alive connections to the model backend
+from metrics import get_metrics, start_process_exporter  # /metrics and the METRICS_PORT / METRICS_FILE export
+
+# Threads running the blocking core per process, and keep-alive connections to the model backend they share
+DEFAULT_WORKERS = int(os.getenv("API_WORKERS", "32"))
+
+FEEDBACK_ANSWERS = ("yes", "no", None)
+
+# Longest a GET /v1/jobs/{id}?wait= request is held open (seconds)
+MAX_JOB_WAIT = 60
+
+
+class BadRequest(Exception):
+    pass
+
+
+# Function to read the inquiry fields of a request body; every field must be a non-empty string
+def parse_inquiry(body):
+    missing = [name for name in email_generator.INQUIRY_FIELDS
+               if name != "client_language" and not str(body.get(name) or "").strip()]
+    if missing:
+        raise BadRequest(f"Missing fields: {', '.join(missing)}")
+    inquiry = {name: str(body.get(name) or "").strip() for name in email_generator.INQUIRY_FIELDS}
+    inquiry["client_language"] = inquiry["client_language"] or "English"
+    return inquiry
+
+
+# Function to read an optional true/false field; only JSON booleans are accepted ("false" is not false)
+def parse_flag(body, name, default=True):
+    value = body.get(name, default)
+    if not isinstance(value, bool):
+        raise BadRequest(f"{name} must be true or false")
+    return value
+
+
+# Function to read an optional whole number field; true and false are not numbers here
+def parse_int(body, name, default):
+    value = body.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise BadRequest(f"{name} must be a whole number")
+    return value
+
+
+def parse_candidates(body):
+    candidates = parse_int(body, "candidates", 1)
+    if not 1 <= candidates <= email_generator.MAX_CANDIDATES:
+        raise BadRequest(f"candidates must be a number from 1 to {email_generator.MAX_CANDIDATES}")
+    return candidates
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise BadRequest("The body must be a JSON object")
+    if not isinstance(body, dict):
+        raise BadRequest("The body must be a JSON object")
+    return body
+
+
+# Turn BadRequest into a 400 JSON answer
+@web.middleware
+async def errors_middleware(request, handler):
+    try:
+        return await handler(request)
+    except BadRequest as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+
+def run_blocking(request, function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(request.app["executor"], lambda: function(*args, **kwargs))
+
+
+# GET /health
+async def health(request):
+    return web.json_response({"status": "ok", "backend": email_generator.chat_api.name, "pid": os.getpid(),
+                              "prompt_version": email_generator.PROMPT_VERSION})
+
+
+# GET /metrics: Prometheus text of this worker process
+async def metrics(request):
+    return web.Response(text=get_metrics().render_prometheus(), content_type="text/plain")
+
+
+# POST /v1/generate: the inquiry fields, optionally "languages" (a list, all generated at once), "use_cache",
+# "use_history" and "candidates" (versions generated in one call, the others are returned as "alternatives").
+# Answers the GenerationResult (or one per language under "variants"); 502 when generation failed.
+async def generate(request):
+    body = await read_json(request)
+    inquiry = parse_inquiry(body)
+    use_cache = parse_flag(body, "use_cache")
+    use_history = parse_flag(body, "use_history")
+    candidates = parse_candidates(body)
+    languages = body.get("languages")
+    if languages:
+        if not isinstance(languages, list) or not all(isinstance(language, str) for language in languages):
+            raise BadRequest("languages must be a list of strings")
+        variants = await run_blocking(request, lambda: list(email_generator.generate_language_variants(
+            inquiry, languages, use_cache=use_cache, use_history=use_history, candidates=candidates)))
+        results = {language: asdict(result) for language, result in variants}
+        status = 200 if any(result.ok for _, result in variants) else 502
+        return web.json_response({"variants": results}, status=status)
+
+    result = await run_blocking(request, email_generator.generate_for_inquiry, inquiry, use_cache=use_cache,
+                                use_history=use_history, candidates=candidates)
+    return web.json_response(asdict(result), status=200 if result.ok else 502)
+
+
+# POST /v1/generate/stream: same body as /v1/generate (one language). Answers Server-Sent Events: "data" events
+# with {"text": piece} while the email is written, then a "done" event with the whole email, or an "error" event.
+async def generate_stream(request):
+    body = await read_json(request)
+    inquiry = parse_inquiry(body)
+    use_cache = parse_flag(body, "use_cache")
+    use_history = parse_flag(body, "use_history")
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    # Runs on a worker thread and hands every piece to the event loop. A client that goes away does not stop it,
+    # the finished email is still cached for the next request.
+    def produce():
+        try:
+            reusable, examples = None, []
+            if use_history:
+                reusable, _, examples = email_generator.find_similar_replies(inquiry)
+            if reusable is not None:
+                loop.call_soon_threadsafe(events.put_nowait, ("data", reusable))
+            else:
+                for text in email_generator.stream_email_response(**inquiry, use_cache=use_cache, examples=examples):
+                    loop.call_soon_threadsafe(events.put_nowait, ("data", text))
+            loop.call_soon_threadsafe(events.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(events.put_nowait, ("error", email_generator.describe_error(e)))
+
+    loop.run_in_executor(request.app["executor"], produce)
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    email_response = ""
+    while True:
+        kind, value = await events.get()
+        if kind == "data":
+            email_response += value
+            await response.write(f"data: {json.dumps({'text': value})}\n\n".encode("utf-8"))
+        elif kind == "done":
+            payload = json.dumps({"email_response": email_response.strip()})
+            await response.write(f"event: done\ndata: {payload}\n\n".encode("utf-8"))
+            break
+        else:
+            await response.write(f"event: error\ndata: {json.dumps({'reason': value})}\n\n".encode("utf-8"))
+            break
+    await response.write_eof()
+    return response
+
+
+# POST /v1/feedback: the inquiry fields, "email_response", "liked_response" ("yes", "no" or null) and "suggestion".
+# A liked email only joins the liked-reply history when it is the one this service generated for the inquiry;
+# "indexed" in the answer says whether it did.
+async def feedback(request):
+    body = await read_json(request)
+    inquiry = parse_inquiry(body)
+    email_response = str(body.get("email_response") or "").strip()
+    liked_response = body.get("liked_response")
+    suggestion = str(body.get("suggestion") or "")
+    if not email_response:
+        raise BadRequest("Missing field: email_response")
+    if liked_response not in FEEDBACK_ANSWERS:
+        raise BadRequest('liked_response must be "yes", "no" or null')
+    if liked_response is None and not suggestion.strip():
+        raise BadRequest("Send liked_response or a suggestion")
+    indexed = await run_blocking(request, email_generator.submit_feedback, inquiry, email_response, liked_response,
+                                 suggestion, check_generated=True)
+    return web.json_response({"status": "stored", "indexed": indexed}, status=201)
+
+
+# POST /v1/jobs: same body as /v1/generate (one language) plus "priority" (higher runs first). Queues the generation
+# in the outbox (see job_queue.py) and answers 202 with the "job_id" at once; an identical pending job is not queued
+# again, its id is returned with "deduplicated": true. 503 with Retry-After when too many jobs are waiting.
+async def submit_job(request):
+    body = await read_json(request)
+    inquiry = parse_inquiry(body)
+    candidates = parse_candidates(body)
+    priority = parse_int(body, "priority", 0)
+    try:
+        job_id, deduplicated = await run_blocking(
+            request, email_generator.enqueue_generation, inquiry, use_cache=parse_flag(body, "use_cache"),
+            use_history=parse_flag(body, "use_history"), candidates=candidates, priority=priority)
+    except QueueFull as e:
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": "30"})
+    return web.json_response({"job_id": job_id, "deduplicated": deduplicated}, status=202,
+                             headers={"Location": f"/v1/jobs/{job_id}"})
+
+
+# GET /v1/jobs/{job_id}: the job's "status" (queued, running, done or failed), "position" while queued, "result"
+# (the GenerationResult) when done and "error" when failed. ?wait=N holds the request until the job has finished,
+# at most N seconds (long polling).
+async def get_job(request):
+    try:
+        wait = float(request.query.get("wait", 0))
+    except ValueError:
+        raise BadRequest("wait must be a number of seconds")
+    if not math.isfinite(wait):
+        raise BadRequest("wait must be a number of seconds")
+    wait = max(0.0, min(wait, MAX_JOB_WAIT))
+    queue = get_queue()
+    deadline = asyncio.get_running_loop().time() + wait
+    while True:
+        job = queue.get(request.match_info["job_id"])
+        if job is None:
+            return web.json_response({"error": "Unknown job"}, status=404)
+        left = deadline - asyncio.get_running_loop().time()
+        if job["status"] not in PENDING or left <= 0:
+            return web.json_response(job)
+        await asyncio.sleep(min(queue.poll_seconds, left, 0.25))
+
+
+def create_app(workers=DEFAULT_WORKERS):
+    app = web.Application(middlewares=[errors_middleware])
+    app["executor"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/v1/generate", generate)
+    app.router.add_post("/v1/generate/stream", generate_stream)
+    app.router.add_post("/v1/feedback", feedback)
+    app.router.add_post("/v1/jobs", submit_job)
+    app.router.add_get("/v1/jobs/{job_id}", get_job)
+
+    async def startup(app):
+        email_generator.start_job_workers()  # jobs queued by earlier runs are picked up too
+
+    async def shutdown(app):
+        app["executor"].shutdown(wait=False)
+
+    app.on_startup.append(startup)
+    app.on_cleanup.append(shutdown)
+    return app
+
+
+# Function to run one API process; worker numbers the processes of --processes (see start_process_exporter)
+def serve(host, port, workers, reuse_port=False, worker=None):
+    start_process_exporter(worker)
+    use_connection_pool(workers)
+    web.run_app(create_app(workers), host=host, port=port, reuse_port=reuse_port, print=None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API for the email response generator.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="generations running at the same time per process")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes sharing the port (Linux / Mac)")
+    args = parser.parse_args(argv)
+
+    print(f"Serving on http://{args.host}:{args.port} with {args.processes} process(es)")
+    if args.processes == 1:
+        serve(args.host, args.port, args.workers)
+        return 0
+    processes = [multiprocessing.Process(target=serve, args=(args.host, args.port, args.workers, True, number))
+                 for number in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import argparse  # command line options
+import csv  # reading inquiries from a CSV file
+import hashlib  # stable ids for inquiries without an "id" column
+import json  # reading JSONL inquiries and writing JSONL results
+import os  # checking for an existing output file
+import sys  # exit code
+import threading  # bounding the number of in-flight requests and serialising output writes
+import time  # per-inquiry timings
+from concurrent.futures import ThreadPoolExecutor  # concurrent calls to the model
+from functools import partial  # the id of an inquiry for its result callback
+
+from email_generator import INQUIRY_FIELDS, describe_error, generate_email_response  # same generation path as the app
+from response_cache import normalize_field  # same normalisation as the response cache
+
+
+# Function to read inquiries one at a time from a .csv or .jsonl file (the file is never loaded as a whole)
+def read_inquiries(path):
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            for row in csv.DictReader(file):
+                yield row
+    else:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+# Function to give every inquiry an id: the "id" column when present, otherwise a hash of its fields
+def inquiry_id(row):
+    if row.get("id"):
+        return str(row["id"])
+    normalized = {name: normalize_field(row.get(name, "")) for name in INQUIRY_FIELDS}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+# Function to find the inquiries an earlier (possibly crashed) run already answered
+def completed_ids(output_path):
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut short by a crash; that inquiry is simply generated again
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+# Function to generate the reply for one inquiry and turn the outcome into an output record
+def process_inquiry(row_id, row, default_name):
+    inquiry = {name: row.get(name) or "" for name in INQUIRY_FIELDS}
+    if not inquiry["your_name"]:
+        inquiry["your_name"] = default_name
+    missing = [name for name in INQUIRY_FIELDS if not inquiry[name]]
+    started = time.monotonic()
+    if missing:
+        return {"id": row_id, "status": "error", "error": "Missing fields: " + ", ".join(missing)}
+    result = generate_email_response(**inquiry)
+    seconds = round(time.monotonic() - started, 3)
+    if not result.ok:
+        return {"id": row_id, "status": "error", "error": result.reason, "attempts": result.attempts,
+                "seconds": seconds}
+    return {"id": row_id, "status": "ok", "inquiry": inquiry, "email_response": result.email_response,
+            "attempts": result.attempts, "seconds": seconds}
+
+
+# Function to answer every inquiry in input_path with at most `concurrency` requests in flight,
+# appending each result to output_path as soon as it is ready
+def run_batch(input_path, output_path, concurrency=4, default_name=""):
+    done = completed_ids(output_path)
+    in_flight = threading.BoundedSemaphore(concurrency)
+    write_lock = threading.Lock()
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        def write_result(row_id, future):
+            try:
+                record = future.result()
+            except Exception as e:
+                # an unexpected error must still be written and counted, not swallowed by the executor
+                record = {"id": row_id, "status": "error", "error": describe_error(e)}
+            finally:
+                in_flight.release()
+            with write_lock:
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                counts[record["status"]] += 1
+
+        for row in read_inquiries(input_path):
+            row_id = inquiry_id(row)
+            if row_id in done:
+                counts["skipped"] += 1
+                continue
+            done.add(row_id)  # duplicated rows in the input are only generated once
+            # Wait for a free slot so the input is read only as fast as the model answers
+            in_flight.acquire()
+            pool.submit(process_inquiry, row_id, row, default_name).add_done_callback(partial(write_result, row_id))
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate email responses for a CSV or JSONL file of inquiries.")
+    parser.add_argument("input", help="inquiries file (.csv or .jsonl), one inquiry per row")
+    parser.add_argument("output", help="results file (.jsonl); an existing file is resumed")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of requests in flight at once")
+    parser.add_argument("--your-name", default="", help="sender name for rows without a your_name column")
+    args = parser.parse_args(argv)
+
+    counts = run_batch(args.input, args.output, concurrency=max(1, args.concurrency), default_name=args.your_name)
+    print(f"{counts['ok']} generated, {counts['error']} failed, {counts['skipped']} already done")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import argparse  # command line options
+import json  # machine-readable results and baselines
+import os  # isolating the benchmark from the real cache and quota
+import sys  # exit code for CI
+import tempfile  # throw-away response cache
+import time  # wall clock measurements
+from concurrent.futures import ThreadPoolExecutor  # concurrent generations
+
+# The benchmark must never touch the real API, the real cache, index and usage log or the production quota
+BENCH_DIR = tempfile.mkdtemp(prefix="smart-response-bench-")
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["RESPONSE_CACHE_PATH"] = os.path.join(BENCH_DIR, "cache.sqlite3")
+os.environ["TOKEN_USAGE_LOG"] = os.path.join(BENCH_DIR, "token_usage.jsonl")
+os.environ["SIMILARITY_INDEX_DIR"] = os.path.join(BENCH_DIR, "similarity_index")
+os.environ["JOB_QUEUE_PATH"] = os.path.join(BENCH_DIR, "jobs.sqlite3")
+os.environ["ROUTING_LOG"] = os.path.join(BENCH_DIR, "routing_decisions.jsonl")
+os.environ.setdefault("OPENAI_REQUESTS_PER_MINUTE", "1000000")
+os.environ.setdefault("OPENAI_TOKENS_PER_MINUTE", "1000000000")
+
+import email_generator  # noqa: E402  (the environment above has to be set first)
+from fake_backend import FakeBackend, Latency, start_server  # noqa: E402
+from llm_backend import OpenAIBackend  # noqa: E402
+from metrics import percentile  # noqa: E402
+
+SAMPLE_INQUIRY = email_generator.build_inquiry(
+    "Alice", "Fernandes", "Fernandes@gmail.com", "USA", "www.google.com", "English", "Web Application",
+    "Full Stack", "I need a website which shows the available resorts in a particular place.", "10000", "Hemanth B G",
+)
+
+
+# Function to time a stream of text pieces: returns (time to first token, total time, full text)
+def measure_stream(chunks):
+    started = time.monotonic()
+    first_token = None
+    text = ""
+    for piece in chunks:
+        if first_token is None:
+            first_token = time.monotonic() - started
+        text += piece
+    return first_token, time.monotonic() - started, text
+
+
+# Function to summarise latencies (seconds) as milliseconds
+def latency_summary(latencies):
+    return {f"p{q}_ms": round(percentile(latencies, q) * 1000, 1) if latencies else None for q in (50, 95, 99)}
+
+
+# Function to run `requests` generations with `concurrency` in flight and measure every one of them
+def run_level(concurrency, requests, stream=False):
+    def one(index):
+        # Different project details per request so nothing is served from the cache
+        inquiry = dict(SAMPLE_INQUIRY, project_details=f"{SAMPLE_INQUIRY['project_details']} Request {index}.")
+        started = time.monotonic()
+        if stream:
+            try:
+                first_token, _, _ = measure_stream(email_generator.stream_email_response(**inquiry, use_cache=False))
+                return time.monotonic() - started, first_token, True
+            except Exception:
+                return time.monotonic() - started, None, False
+        result = email_generator.generate_email_response(**inquiry, use_cache=False)
+        return time.monotonic() - started, None, result.ok
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(requests)))
+    wall = time.monotonic() - started
+
+    latencies = [latency for latency, _, ok in outcomes if ok]
+    level = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(1 for _, _, ok in outcomes if not ok),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        **latency_summary(latencies),
+    }
+    if stream:
+        level["time_to_first_token"] = latency_summary([first for _, first, ok in outcomes if ok])
+    return level
+
+
+# Function to list the regressions of `results` against a baseline report: p95 latency up or
+# throughput down by more than `tolerance` (0.2 = 20%) at the same concurrency
+def find_regressions(results, baseline, tolerance):
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    regressions = []
+    for level in results["levels"]:
+        before = previous.get(level["concurrency"])
+        if not before:
+            continue
+        if before.get("p95_ms") and level.get("p95_ms") and level["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"concurrency {level['concurrency']}: p95 {before['p95_ms']}ms -> {level['p95_ms']}ms")
+        if (before.get("throughput_rps") and level.get("throughput_rps") is not None
+                and level["throughput_rps"] < before["throughput_rps"] * (1 - tolerance)):
+            regressions.append(f"concurrency {level['concurrency']}: throughput "
+                               f"{before['throughput_rps']} -> {level['throughput_rps']} req/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark generate_email_response against the fake model backend.")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="requests per concurrency level")
+    parser.add_argument("--latency", type=float, default=0.2, help="mean time to first token of the fake (s)")
+    parser.add_argument("--latency-spread", type=float, default=0.0)
+    parser.add_argument("--latency-distribution", default="constant",
+                        choices=["constant", "uniform", "normal", "lognormal"])
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between two fake tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake requests that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", action="store_true", help="benchmark the streaming path (adds time to first token)")
+    parser.add_argument("--http", action="store_true", help="go through OpenAIBackend and the localhost fake server")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --output file; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    args = parser.parse_args(argv)
+
+    results = {"settings": vars(args).copy(), "levels": []}
+    server = None
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        fake = FakeBackend(Latency(args.latency, args.latency_spread, args.latency_distribution),
+                           token_latency=args.token_latency, error_rate=args.error_rate, seed=args.seed)
+        if args.http:
+            if server is not None:
+                server.shutdown()
+            server = start_server(fake)
+            email_generator.chat_api = OpenAIBackend(api_key="fake",
+                                                     api_base=f"http://127.0.0.1:{server.server_port}/v1")
+        else:
+            email_generator.chat_api = fake
+        level = run_level(concurrency, args.requests, stream=args.stream)
+        results["levels"].append(level)
+        print(f"concurrency {level['concurrency']:>3}: {level['throughput_rps']} req/s, "
+              f"p50 {level['p50_ms']}ms, p95 {level['p95_ms']}ms, p99 {level['p99_ms']}ms, "
+              f"{level['errors']} errors")
+    if server is not None:
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,477 @@
+# Generation core shared by the Streamlit app (qscript.py), the HTTP API (api_server.py), the batch runner and the
+# benchmarks: prompts, model calls, caching, liked-reply history, the outbox and feedback. It does not import
+# Streamlit, so every process that imports it gets one backend, cache and set of worker threads.
+import openai  # interacting with the OpenAI API
+import os  # to interact with the os and to read the env variable
+import time  # request durations for the metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed  # generating several languages at once
+from dataclasses import asdict, dataclass, field  # structured result of a generation
+from contextlib import nullcontext  # no cross-process lock unless single-flight is configured
+from functools import partial  # prompt builder with few-shot examples
+from dotenv import load_dotenv  # to read the variables from the .env file
+
+# Load environment variables from the .env file before the modules below read their settings at import
+load_dotenv()
+
+from feedback_store import get_store  # append-only feedback log
+from response_cache import get_cache, make_cache_key  # cache of generated responses
+from rate_limiter import MAX_ATTEMPTS, RateLimitTimeout, call_with_retries, get_limiter  # shared quota and retries
+from llm_backend import get_backend  # OpenAI or the local fake backend
+from token_budget import count_tokens, plan_budget, prepare_fields, record_usage, trim_text  # prompt token budget
+from similarity_index import adapt_reply, can_reuse, get_index  # liked replies to similar inquiries
+from metrics import get_metrics  # stage timings and usage
+from single_flight import SINGLE_FLIGHT_DIR, get_flights, process_lock  # one generation for identical requests
+from ranking import rank_candidates  # choosing the best of several candidate replies
+from templates import BodyStream, assemble_email, clean_body, render_frame  # subject, greeting and signature
+from model_router import ROUTER_ATTEMPTS_PER_MODEL, get_router  # model chosen per inquiry, failover
+from job_queue import JOB_WORKERS, JobFailed, RetryLater, get_queue, get_worker_pool  # outbox for busy times
+
+# Model settings; bump PROMPT_VERSION whenever the prompt below changes so cached responses are not reused.
+# The model of every request is chosen by model_router.py; MODEL is the one cache keys and token estimates use.
+MODEL = "gpt-3.5-turbo"
+TEMPERATURE = 0.3
+PROMPT_VERSION = "4"
+
+# Liked replies to inquiries at least this similar are reused as they are, less similar ones (down to
+# FEW_SHOT_SIMILARITY) are shown to the model as examples
+REUSE_SIMILARITY = float(os.getenv("REUSE_SIMILARITY", "0.92"))
+FEW_SHOT_SIMILARITY = float(os.getenv("FEW_SHOT_SIMILARITY", "0.35"))
+FEW_SHOT_EXAMPLES = 2
+
+# Most candidate replies one request may ask the model for (n=); the best one is shown, the others are kept as
+# alternatives that can be shown without another model call
+MAX_CANDIDATES = int(os.getenv("MAX_CANDIDATES", "5"))
+
+# Errors worth retrying: the request itself was fine, the service was busy or unreachable
+TRANSIENT_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+)
+
+# Errors after which a generation is queued in the outbox (see job_queue.py) instead of being given up: the
+# retries are spent, but the service will most likely answer a little later
+BUSY_ERRORS = TRANSIENT_ERRORS + (RateLimitTimeout,)
+
+# Languages the email can be written in; several can be generated at once
+LANGUAGES = ["English", "Spanish", "French", "German", "Italian", "Portuguese"]
+
+# Names of the inquiry fields, in the order generate_email_response takes them
+INQUIRY_FIELDS = [
+    "client_first_name", "client_last_name", "client_email", "client_country", "client_website",
+    "client_language", "project_type", "service_category", "project_details", "budget", "your_name",
+]
+
+# Function to build the model backend; called once per process, when this module is first imported (by the
+# Streamlit app, the HTTP API, the batch runner or the benchmarks). The Prometheus export is started by the app and
+# the API themselves (see metrics.start_process_exporter).
+def load_chat_backend():
+    with get_metrics().timed("startup"):
+        # Retrieve the API key from the environment (.env was loaded above)
+        backend = get_backend(os.getenv("MY_KEY"))
+    return backend
+
+
+# Backend used for every model call (see llm_backend.py); benchmarks swap in fake_backend.FakeBackend
+chat_api = load_chat_backend()
+
+
+# Outcome of one generation: status is "success", "retried" (succeeded after retrying) or "failed",
+# in which case reason explains why and email_response is empty
+@dataclass
+class GenerationResult:
+    status: str
+    email_response: str = ""
+    reason: str = ""
+    attempts: int = 0
+    cached: bool = False
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reused: bool = False  # a liked reply to a similar inquiry, no model call
+    similarity: float = 0.0
+    score: float = 0.0  # ranking score of email_response when several candidates were generated
+    alternatives: list = field(default_factory=list)  # the other candidates, best first
+    retryable: bool = False  # failed only because the service was busy, worth queuing (see enqueue_generation)
+    model: str = ""  # the model that wrote email_response (see model_router.py)
+
+    @property
+    def ok(self):
+        return self.status != "failed"
+
+
+# Function to put the inquiry fields in a dict keyed by INQUIRY_FIELDS
+def build_inquiry(client_first_name, client_last_name, client_email, client_country, client_website,client_language, project_type, service_category, project_details, budget, your_name):
+    return {
+        "client_first_name": client_first_name,
+        "client_last_name": client_last_name,
+        "client_email": client_email,
+        "client_country": client_country,
+        "client_website": client_website,
+        "client_language": client_language,
+        "project_type": project_type,
+        "service_category": service_category,
+        "project_details": project_details,
+        "budget": budget,
+        "your_name": your_name,
+    }
+
+
+# Function to build the prompt that explains to the AI what kind of response to generate, including tone and content.
+# The model only writes the body; subject, greeting, website reference and signature come from templates.py.
+# examples are (project details, liked reply body) pairs of similar inquiries, shown to the model as few-shot examples
+def build_prompt(client_first_name, client_last_name, client_email, client_country, client_website,client_language, project_type, service_category, project_details, budget, your_name, examples=None):
+    examples_text = ""
+    if examples:
+        examples_text = "\n    Replies to similar inquiries that were liked, use them as examples of tone and structure but do not copy their client details:\n"
+        for number, (example_details, example_reply) in enumerate(examples, 1):
+            examples_text += f"""
+    Example {number} project details: {example_details}
+    Example {number} reply body:
+    {example_reply}
+"""
+    return f"""
+    You are a professional consultant. You have received a project inquiry with the following details:
+
+    - Client First Name: {client_first_name}
+    - Client Last Name: {client_last_name}
+    - Client Email: {client_email}
+    - Client Country: {client_country}
+    - Client Website: {client_website}
+    - Client Language: {client_language}
+    - Project Type: {project_type}
+    - Service Category: {service_category}
+    - Project Details: {project_details}
+    - Budget: {budget}
+
+    Please write only the body of a professional and human-like email response in {client_language}. Confirm the project details, provide a summary, and suggest next steps. Avoid generic phrases like "I hope this email finds you well." The response should sound natural and personalized. Do not write a subject line, a greeting, a closing or a signature, they are added separately.
+    {examples_text}"""
+
+
+# Function to look up liked replies to similar inquiries in the same language (see similarity_index.py). A reply is
+# only reused when its budget and country match too (see similarity_index.can_reuse).
+# Returns (reusable reply or None, its similarity, few-shot examples for build_prompt)
+def find_similar_replies(inquiry):
+    with get_metrics().timed("history"):
+        matches = get_index().search(inquiry, k=FEW_SHOT_EXAMPLES)
+    examples = [
+        (trim_text(entry["inquiry"].get("project_details", ""), 150), trim_text(clean_body(entry["email_response"]), 300))
+        for similarity, entry in matches if similarity >= FEW_SHOT_SIMILARITY
+    ]
+    for similarity, entry in matches:
+        if similarity >= REUSE_SIMILARITY and can_reuse(entry["inquiry"], inquiry):
+            return adapt_reply(entry["inquiry"], entry["email_response"], inquiry), similarity, examples
+    return None, 0.0, examples
+
+
+# Function to choose the models to try for an inquiry (see model_router.py) from its language, service category
+# and the size of its project details
+def route_inquiry(inquiry):
+    return get_router().route(inquiry, count_tokens(str(inquiry.get("project_details") or ""), MODEL))
+
+
+# Function to call the chat API with the prompt and max_tokens of a token budget (see token_budget.py) under the
+# shared rate limiter, retrying transient errors with backoff and failing over to the next model of the route (see
+# model_router.py). Returns (response, attempts, model that answered) or raises the last error.
+def call_chat_api(budget, route, **kwargs):
+    estimated_tokens = budget.prompt_tokens + budget.max_tokens * kwargs.get("n", 1)
+
+    # A model that keeps failing is left for the next one of the route after a few attempts
+    def call_model(model):
+        return call_with_retries(
+            lambda: chat_api.create(
+                model=model,
+                messages=[{"role": "user", "content": budget.prompt}],
+                max_tokens=budget.max_tokens,  # chosen from the size of the brief and the reply language
+                temperature=TEMPERATURE,  # lower the value of this it will give more precise and accurate response in the email
+                **kwargs
+            ),
+            is_transient=lambda e: isinstance(e, TRANSIENT_ERRORS),
+            is_rate_limit=lambda e: isinstance(e, openai.error.RateLimitError),
+            limiter=get_limiter(),
+            estimated_tokens=estimated_tokens,
+            max_attempts=MAX_ATTEMPTS if model == route.models[-1] else ROUTER_ATTEMPTS_PER_MODEL,
+        )
+
+    with get_metrics().timed("api_call"):
+        response, attempts, model = get_router().call(route, call_model,
+                                                      is_transient=lambda e: isinstance(e, TRANSIENT_ERRORS),
+                                                      stream=bool(kwargs.get("stream")))
+    # Give the unused part of the estimate back to the tokens-per-minute bucket
+    usage = None if kwargs.get("stream") else response.get("usage")
+    if usage:
+        get_limiter().settle(estimated_tokens, usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+    return response, attempts, model
+
+
+# Function to stream the email response: yields pieces of text as the model produces them (stream=True),
+# so the page can show the first words long before the whole email is finished. Errors are raised to the
+# caller; the complete email is cached once the stream ends. examples come from find_similar_replies.
+# Callers streaming the same inquiry at the same time share one stream and all receive every piece.
+def stream_email_response(client_first_name, client_last_name, client_email, client_country, client_website,client_language, project_type, service_category, project_details, budget, your_name, use_cache=True, examples=None):
+    inquiry = build_inquiry(client_first_name, client_last_name, client_email, client_country, client_website, client_language,
+                            project_type, service_category, project_details, budget, your_name)
+    started = time.perf_counter()
+    cache_key = make_cache_key(inquiry, MODEL, TEMPERATURE, PROMPT_VERSION)
+    chunks, leader = get_flights().stream(f"{cache_key}:{use_cache}",
+                                          lambda: _stream_response(inquiry, cache_key, use_cache, examples, started))
+    yield from chunks
+    if not leader:
+        get_metrics().record_request(MODEL, time.perf_counter() - started, "success", "coalesced", stream=True)
+
+
+def _stream_response(inquiry, cache_key, use_cache, examples, started):
+    if use_cache:
+        with get_metrics().timed("cache_lookup"):
+            cached_response = get_cache().get(cache_key)
+        if cached_response is not None:
+            get_metrics().record_request(MODEL, time.perf_counter() - started, "success", "hit", stream=True)
+            yield cached_response
+            return
+
+    # Another process may be generating the same inquiry (see single_flight.py); wait for it and use its result
+    with process_lock(cache_key) if use_cache and SINGLE_FLIGHT_DIR else nullcontext():
+        if use_cache and SINGLE_FLIGHT_DIR:
+            cached_response = get_cache().get(cache_key)
+            if cached_response is not None:
+                get_metrics().record_request(MODEL, time.perf_counter() - started, "success", "coalesced",
+                                             stream=True)
+                yield cached_response
+                return
+        yield from _stream_model(inquiry, cache_key, examples, started)
+
+
+def _stream_model(inquiry, cache_key, examples, started):
+    # Only opening the stream is retried (and failed over to another model); once text has been shown it cannot be
+    # taken back
+    route = route_inquiry(inquiry)
+    with get_metrics().timed("prompt"):
+        budget = plan_budget(inquiry, partial(build_prompt, examples=examples), route.model)
+    head, tail = render_frame(inquiry)
+    model = route.model
+    first_token = None
+    opened = time.perf_counter()
+    try:
+        # The subject and greeting are shown at once, the model's body is cleaned as it arrives
+        yield head
+        opened = time.perf_counter()
+        stream, attempts, model = call_chat_api(budget, route, stream=True)
+        body_stream = BodyStream()
+        body = []
+        model_text = []
+        for chunk in stream:
+            text = chunk['choices'][0].get('delta', {}).get('content')
+            if text:
+                if first_token is None:
+                    # the router compares streaming models by their time to first token
+                    first_token = time.perf_counter() - opened
+                    get_router().record(model, first_token, True)
+                model_text.append(text)
+                body.append(body_stream.feed(text))
+                if body[-1]:
+                    yield body[-1]
+        body.append(body_stream.finish())
+        if not "".join(body).strip():
+            raise ValueError("The model did not write an email body, please try again.")
+        yield body[-1] + tail
+    except Exception as e:
+        if first_token is None and not hasattr(e, "attempts") and isinstance(e, TRANSIENT_ERRORS):
+            get_router().record(model, time.perf_counter() - opened, False)  # the stream broke before any text
+        get_metrics().record_request(model, time.perf_counter() - started, "failed", "miss",
+                                     attempts=getattr(e, "attempts", 1), stream=True)
+        raise
+
+    email_response = (head + "".join(body) + tail).strip()
+    # Streamed replies carry no usage, so the completion is counted locally
+    completion_tokens = count_tokens("".join(model_text), model)
+    record_usage(budget, model, None, completion_tokens)
+    get_cache().set(cache_key, email_response)
+    get_metrics().record_request(model, time.perf_counter() - started, "success" if attempts == 1 else "retried",
+                                 "miss", attempts=attempts, prompt_tokens=budget.prompt_tokens,
+                                 completion_tokens=completion_tokens, stream=True)
+
+
+# Function to turn an error from the model call into the message shown to the user
+def describe_error(e):
+    if isinstance(e, openai.error.InvalidRequestError):
+        return f"Invalid Request Error: {str(e)}"
+    if isinstance(e, openai.error.AuthenticationError):
+        return f"Authentication Error: Please check your API key. {str(e)}"
+    if isinstance(e, openai.error.RateLimitError):
+        return f"Rate Limit Error: You have hit the rate limit. {str(e)}"
+    if isinstance(e, RateLimitTimeout):
+        return f"Rate Limit Error: Too many requests right now, please try again shortly ({str(e)})."
+    return f"Error generating response: {str(e)}"
+
+
+# Function to generate the email response using chat models (gpt-3.5-turbo or gpt-4)
+# Set use_cache=False to skip the cached response (used by the "Regenerate" button); with use_history a liked reply
+# to a near-identical inquiry is reused without calling the model, otherwise similar liked replies become examples
+def generate_email_response(client_first_name, client_last_name, client_email, client_country, client_website,client_language, project_type, service_category, project_details, budget, your_name, use_cache=True, use_history=True):
+    inquiry = build_inquiry(client_first_name, client_last_name, client_email, client_country, client_website, client_language,
+                            project_type, service_category, project_details, budget, your_name)
+    return generate_for_inquiry(inquiry, use_cache=use_cache, use_history=use_history)
+
+
+# Function to generate the email response for an inquiry dict (see generate_email_response). reuse=False still
+# uses similar liked replies as examples but never returns one as it is; prepared are the shortened inquiry
+# fields from token_budget.prepare_fields, shared by the language variants of one inquiry. candidates > 1 asks the
+# model for that many replies in one call and ranks them (see ranking.py); it always calls the model, the best
+# reply is cached. Concurrent calls for the same inquiry and options share one generation and all get its result.
+def generate_for_inquiry(inquiry, use_cache=True, use_history=True, reuse=True, prepared=None, candidates=1):
+    started = time.perf_counter()
+    candidates = max(1, min(MAX_CANDIDATES, int(candidates)))
+    cache_key = make_cache_key(inquiry, MODEL, TEMPERATURE, PROMPT_VERSION)
+    with get_metrics().profiled("generate"):
+        result, leader = get_flights().do(f"{cache_key}:{use_cache}:{use_history}:{reuse}:{candidates}",
+                                          lambda: _generate(inquiry, cache_key, use_cache, use_history, reuse,
+                                                            prepared, candidates))
+    if not leader:
+        # the tokens were spent (and counted) by the call that was shared
+        get_metrics().record_request(MODEL, time.perf_counter() - started, result.status, "coalesced")
+        return result
+    cache = "hit" if result.cached else "reused" if result.reused else "miss"
+    get_metrics().record_request(result.model or MODEL, time.perf_counter() - started, result.status, cache,
+                                 attempts=result.attempts, prompt_tokens=result.prompt_tokens,
+                                 completion_tokens=result.completion_tokens)
+    return result
+
+
+def _generate(inquiry, cache_key, use_cache, use_history, reuse, prepared, candidates):
+    if candidates > 1:
+        use_cache, reuse = False, False  # alternatives were asked for, one stored reply is not enough
+    if use_cache:
+        with get_metrics().timed("cache_lookup"):
+            cached_response = get_cache().get(cache_key)
+        if cached_response is not None:
+            return GenerationResult("success", cached_response, cached=True)
+
+    examples = []
+    if use_history:
+        reusable, similarity, examples = find_similar_replies(inquiry)
+        if reusable is not None and reuse:
+            return GenerationResult("success", reusable, reused=True, similarity=similarity)
+
+    # Another process may be generating the same inquiry (see single_flight.py); wait for it and use its result
+    with process_lock(cache_key) if use_cache and SINGLE_FLIGHT_DIR else nullcontext():
+        if use_cache and SINGLE_FLIGHT_DIR:
+            cached_response = get_cache().get(cache_key)
+            if cached_response is not None:
+                return GenerationResult("success", cached_response, cached=True)
+        return _call_model(inquiry, cache_key, examples, prepared, candidates)
+
+
+def _call_model(inquiry, cache_key, examples, prepared, candidates=1):
+    # The model is chosen first, long fields are shortened and max_tokens is chosen for it before the call
+    route = route_inquiry(inquiry)
+    with get_metrics().timed("prompt"):
+        budget = plan_budget(inquiry, partial(build_prompt, examples=examples), route.model, prepared=prepared)
+
+    # Try to make the API call to OpenAI
+    try:
+        response, attempts, model = call_chat_api(budget, route, **({"n": candidates} if candidates > 1 else {}))
+    except Exception as e:
+        return GenerationResult("failed", reason=describe_error(e), attempts=getattr(e, "attempts", 0),
+                                prompt_tokens=budget.prompt_tokens, retryable=isinstance(e, BUSY_ERRORS))
+
+    # Extracting the email bodies; several candidates are ranked on their bodies (the template parts are the same
+    # for all of them), then the emails are put together and the best one is used
+    bodies = [choice['message']['content'] for choice in response['choices']]
+    cleaned = [body for body in (clean_body(body) for body in bodies) if body]
+    usage = response.get("usage") or {}
+    if not cleaned:
+        return GenerationResult("failed", reason="The model did not write an email body, please try again.",
+                                attempts=attempts, prompt_tokens=usage.get("prompt_tokens", budget.prompt_tokens),
+                                model=model)
+    score = 0.0
+    if len(cleaned) > 1:
+        ranked = rank_candidates(cleaned, inquiry, [clean_body(reply) for _, reply in examples])
+        score = ranked[0][0]
+        cleaned = [body for _, _, body in ranked]
+    replies = [assemble_email(inquiry, body) for body in cleaned]
+    email_response, alternatives = replies[0], replies[1:]
+    prompt_tokens = usage.get("prompt_tokens", budget.prompt_tokens)
+    completion_tokens = usage.get("completion_tokens", sum(count_tokens(body, model) for body in bodies))
+    record_usage(budget, model, usage.get("prompt_tokens"), completion_tokens)
+
+    # Only successful responses are cached, errors are retried on the next click
+    get_cache().set(cache_key, email_response)
+
+    return GenerationResult("success" if attempts == 1 else "retried", email_response, attempts=attempts,
+                            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, score=score,
+                            alternatives=alternatives, model=model)
+
+
+# Function to generate the same inquiry in several languages at once. The inquiry fields are shortened once for
+# all languages, every language is generated (and cached) on its own thread under the shared rate limiter, and
+# (language, GenerationResult) pairs are yielded in the order they finish.
+def generate_language_variants(inquiry, languages, use_cache=True, use_history=True, reuse=True, candidates=1):
+    prepared = prepare_fields(inquiry, MODEL)
+    with ThreadPoolExecutor(max_workers=max(1, len(languages)), thread_name_prefix="language") as pool:
+        futures = {
+            pool.submit(generate_for_inquiry, dict(inquiry, client_language=language), use_cache=use_cache,
+                        use_history=use_history, reuse=reuse, prepared=prepared, candidates=candidates): language
+            for language in languages
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+# Function to start the outbox worker pool of this process (once, see job_queue.get_worker_pool); it also picks up
+# jobs left over from an earlier run
+def start_job_workers():
+    return get_worker_pool(run_generation_job, JOB_WORKERS)
+
+
+# Function to queue a generation in the outbox, used when the service is busy: the job survives a closed page or a
+# restart, identical pending jobs are merged, and higher priorities are run first. Returns (job id, deduplicated);
+# raises job_queue.QueueFull when too many jobs are waiting.
+def enqueue_generation(inquiry, use_cache=True, use_history=True, candidates=1, priority=0):
+    start_job_workers()
+    cache_key = make_cache_key(inquiry, MODEL, TEMPERATURE, PROMPT_VERSION)
+    payload = {"inquiry": inquiry, "use_cache": use_cache, "use_history": use_history, "candidates": candidates}
+    return get_queue().submit(payload, priority=priority,
+                              dedup_key=f"{cache_key}:{use_cache}:{use_history}:{candidates}")
+
+
+# Function to run one outbox job (see enqueue_generation); the GenerationResult is stored as the job's result
+def run_generation_job(payload):
+    result = generate_for_inquiry(payload["inquiry"], use_cache=payload["use_cache"],
+                                  use_history=payload["use_history"], candidates=payload["candidates"])
+    if not result.ok:
+        raise RetryLater(result.reason) if result.retryable else JobFailed(result.reason)
+    return asdict(result)
+
+
+# Function to store feedback: the record is appended to the shared JSON Lines log (see feedback_store.py)
+# instead of rewriting the whole feedback.json, so concurrent sessions never overwrite each other
+def store_feedback(feedback_data):
+    with get_metrics().timed("feedback_write"):
+        get_store().append(feedback_data)
+
+
+# Function to check that email_response is the email this service generated for the inquiry (the one in the
+# response cache); replies written by someone else must never be reused for other clients
+def is_generated_reply(inquiry, email_response):
+    cached_response = get_cache().get(make_cache_key(inquiry, MODEL, TEMPERATURE, PROMPT_VERSION))
+    return cached_response is not None and cached_response.strip() == email_response.strip()
+
+
+# Function to store the feedback on one generated email, used by the app and the HTTP API (see api_server.py).
+# With check_generated a liked reply is only added to the liked-reply index when is_generated_reply confirms it;
+# the feedback itself is always stored. Returns whether the reply was added to the index.
+def submit_feedback(inquiry, email_response, liked_response, suggestion, check_generated=False):
+    feedback_data = {
+        **inquiry,  # the inquiry, so feedback can be analysed per language, project type, ...
+        "email_response": email_response,
+        "liked_response": liked_response,  # Storing whether they liked the response (None if not answered)
+        "suggestion": suggestion,  # Saving the suggestion (can be empty if no suggestion is provided)
+        "prompt_version": PROMPT_VERSION,
+    }
+    store_feedback(feedback_data)
+    if liked_response != "yes" or (check_generated and not is_generated_reply(inquiry, email_response)):
+        return False
+    # Liked replies are reused for, or shown as examples to, similar inquiries later on
+    get_index().add(inquiry, email_response)
+    return True
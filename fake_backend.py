@@ -0,0 +1,224 @@
+import argparse  # command line options for the fake server
+import json  # request and response bodies of the fake server
+import math  # lognormal parameters
+import os  # reading the fake settings from the environment
+import random  # latency distributions and error injection
+import re  # pulling the sender name out of the prompt
+import threading  # the random generator is shared by concurrent requests
+import time  # simulated latency
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # localhost stand-in for the OpenAI API
+
+import openai  # the fake raises the same errors as the real API
+
+from llm_backend import ChatBackend
+
+# Words the fake model "generates" after the fixed subject line
+FILLER = (
+    "Thank you for sharing the details of your project. We have reviewed the scope, the budget and the timeline "
+    "and we are confident we can deliver it. As a next step we suggest a short call to agree on the milestones."
+).split()
+
+# Injected errors: name -> (HTTP status of the fake server, openai error class raised in-process)
+ERRORS = {
+    "rate_limit": (429, openai.error.RateLimitError),
+    "server": (503, openai.error.ServiceUnavailableError),
+    "timeout": (504, openai.error.Timeout),
+}
+
+
+# Latency in seconds drawn from a distribution: "constant", "uniform" (mean +/- spread),
+# "normal" (standard deviation spread) or "lognormal" (mean with a long tail, sigma spread)
+class Latency:
+    def __init__(self, mean, spread=0.0, distribution="constant"):
+        if distribution not in ("constant", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.mean = mean
+        self.spread = spread
+        self.distribution = distribution
+
+    def sample(self, rng):
+        if self.distribution == "uniform":
+            value = rng.uniform(self.mean - self.spread, self.mean + self.spread)
+        elif self.distribution == "normal":
+            value = rng.gauss(self.mean, self.spread)
+        elif self.distribution == "lognormal" and self.mean > 0:
+            # mu chosen so that the distribution's mean stays at self.mean
+            value = rng.lognormvariate(math.log(self.mean) - self.spread ** 2 / 2, self.spread)
+        else:
+            value = self.mean
+        return max(0.0, value)
+
+
+# Local deterministic stand-in for the OpenAI chat API: answers with a fixed-shape email after a simulated delay,
+# either as one response dict or, with stream=True, as delta chunks shaped like the OpenAI streaming API.
+# A seed makes the latencies and injected errors reproducible.
+class FakeBackend(ChatBackend):
+    name = "fake"
+
+    def __init__(self, first_token_latency=None, token_latency=0.02, error_rate=0.0,
+                 error_kinds=("rate_limit", "server", "timeout"), seed=0):
+        self.first_token_latency = first_token_latency if first_token_latency is not None else Latency(0.5)
+        self.token_latency = token_latency  # seconds between two tokens
+        self.error_rate = error_rate  # share of requests failing with one of error_kinds
+        self.error_kinds = tuple(error_kinds)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # Fake configured by FAKE_LLM_LATENCY, FAKE_LLM_LATENCY_SPREAD, FAKE_LLM_LATENCY_DISTRIBUTION,
+    # FAKE_LLM_TOKEN_LATENCY, FAKE_LLM_ERROR_RATE and FAKE_LLM_SEED
+    @classmethod
+    def from_env(cls):
+        return cls(
+            first_token_latency=Latency(float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+                                        float(os.getenv("FAKE_LLM_LATENCY_SPREAD", "0")),
+                                        os.getenv("FAKE_LLM_LATENCY_DISTRIBUTION", "constant")),
+            token_latency=float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0.02")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+        )
+
+    # Decide the fate of one request: (first token latency, injected error name or None)
+    def plan(self):
+        with self._lock:
+            latency = self.first_token_latency.sample(self._rng)
+            error = None
+            if self.error_kinds and self._rng.random() < self.error_rate:
+                error = self._rng.choice(self.error_kinds)
+        return latency, error
+
+    def create(self, model, messages, max_tokens=300, temperature=0.7, stream=False, **kwargs):
+        latency, error = self.plan()
+        if error:
+            time.sleep(latency)
+            raise ERRORS[error][1](f"Injected {error} error from the fake backend")
+        prompt = messages[-1]["content"]
+        if stream:
+            return self._stream(model, self.reply_tokens(prompt, max_tokens), latency)
+        candidates = [self.reply_tokens(prompt, max_tokens, index) for index in range(kwargs.get("n", 1))]
+        time.sleep(latency + self.token_latency * (max(len(tokens) for tokens in candidates) - 1))
+        return self.response(model, prompt, candidates)
+
+    def _stream(self, model, tokens, latency):
+        time.sleep(latency)
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(self.token_latency)
+            yield {"object": "chat.completion.chunk", "model": model,
+                   "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+        yield {"object": "chat.completion.chunk", "model": model,
+               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+    # Response dict with one choice per candidate (a list of tokens each)
+    @staticmethod
+    def response(model, prompt, candidates):
+        completion_tokens = sum(len(tokens) for tokens in candidates)
+        return {
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": index, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": "stop"} for index, tokens in enumerate(candidates)],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": completion_tokens,
+                      "total_tokens": len(prompt) // 4 + completion_tokens},
+        }
+
+    # The reply: a subject line, filler text repeated up to max_tokens and the sign-off asked for in the prompt, or
+    # only paragraphs of filler text when the prompt asks for the body only. Candidates of one n= request differ,
+    # like real ones: candidate 1 also mentions the client website, candidate 2 signs off its own way.
+    @staticmethod
+    def reply_tokens(prompt, max_tokens, candidate=0):
+        match = re.search(r"best regards from (.+?) at the end", prompt)
+        sender = match.group(1).strip() if match else "the team"
+        website = re.search(r"Client Website: (\S+)", prompt)
+        body_only = "only the body" in prompt
+        body = [] if body_only else ["Subject:", " Your", " project", " inquiry\n\n"]
+        if candidate % 3 == 1 and website:
+            body += ["We", " had", " a", " look", " at", " " + website.group(1) + ".\n\n"]
+        if candidate % 3 == 2:
+            closing = ["\n\nThanks,", "\n" + sender]
+        else:
+            closing = [] if body_only else ["\n\nBest", " regards", " from", " " + sender]
+        room = max(0, max_tokens - len(body) - len(closing))
+        filler = [(" " if index % 30 else "\n\n" if index else "") + FILLER[(index + candidate) % len(FILLER)]
+                  for index in range(room)]
+        return body + filler + closing
+
+
+# HTTP handler answering POST /v1/chat/completions like the OpenAI API, so OpenAIBackend can be pointed at it
+# with OPENAI_API_BASE=http://127.0.0.1:<port>/v1 and the whole HTTP path is exercised
+class _FakeHandler(BaseHTTPRequestHandler):
+    backend = None
+    protocol_version = "HTTP/1.1"  # keep-alive like the real API
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        latency, error = self.backend.plan()
+        time.sleep(latency)
+        if error:
+            self._send_json(ERRORS[error][0], {"error": {"message": f"Injected {error} error from the fake server",
+                                                         "type": error}})
+            return
+        prompt = body["messages"][-1]["content"]
+        tokens = self.backend.reply_tokens(prompt, body.get("max_tokens", 300))
+        if not body.get("stream"):
+            candidates = [self.backend.reply_tokens(prompt, body.get("max_tokens", 300), index)
+                          for index in range(body.get("n", 1))]
+            time.sleep(self.backend.token_latency * (max(len(tokens) for tokens in candidates) - 1))
+            self._send_json(200, self.backend.response(body.get("model"), prompt, candidates))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in self.backend._stream(body.get("model"), tokens, 0):
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._send_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown the benchmark output
+
+
+# Function to start the fake server in a background thread; returns the server (call shutdown() to stop it)
+def start_server(backend, host="127.0.0.1", port=0):
+    handler = type("FakeHandler", (_FakeHandler,), {"backend": backend})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the fake model backend on localhost "
+                                                 "(use OPENAI_API_BASE=http://HOST:PORT/v1 to point the app at it).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    server = start_server(FakeBackend.from_env(), args.host, args.port)
+    print(f"Fake model backend listening on http://{args.host}:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse  # command line reports
+import json  # reading the JSON Lines segments
+import os  # paths of the feedback log
+import sqlite3  # indexed feedback repository
+import sys  # exit code
+import threading  # one connection shared by several sessions
+import time  # report windows
+from datetime import datetime, timezone  # day of a feedback record
+
+from dotenv import load_dotenv  # settings from the .env file, like the app
+
+# FEEDBACK_DIR and FEEDBACK_DB_PATH may be set in .env; it has to be loaded before feedback_store reads them
+load_dotenv()
+
+from feedback_store import FEEDBACK_DIR, LEGACY_FEEDBACK_FILE, SEGMENT_PATTERN, FeedbackStore
+
+FEEDBACK_DB_PATH = os.getenv("FEEDBACK_DB_PATH", "feedback.sqlite3")
+
+# Columns a feedback record can be grouped by in like-rate reports
+GROUP_COLUMNS = ("service_category", "project_type", "language", "prompt_version")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY,
+    recorded_at REAL,
+    day TEXT NOT NULL,
+    your_name TEXT,
+    client_first_name TEXT,
+    client_last_name TEXT,
+    client_email TEXT,
+    liked_response TEXT,
+    language TEXT NOT NULL,
+    project_type TEXT NOT NULL,
+    service_category TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    email_response TEXT,
+    suggestion TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feedback_client_email ON feedback (client_email);
+CREATE INDEX IF NOT EXISTS feedback_liked_response ON feedback (liked_response);
+CREATE INDEX IF NOT EXISTS feedback_language ON feedback (language);
+CREATE INDEX IF NOT EXISTS feedback_project_type ON feedback (project_type);
+CREATE INDEX IF NOT EXISTS feedback_service_category ON feedback (service_category);
+CREATE INDEX IF NOT EXISTS feedback_recorded_at ON feedback (recorded_at);
+CREATE INDEX IF NOT EXISTS feedback_prompt_version ON feedback (prompt_version);
+
+-- one row per day and combination of the group columns, kept up to date on every insert
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    day TEXT NOT NULL,
+    service_category TEXT NOT NULL,
+    project_type TEXT NOT NULL,
+    language TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    dislikes INTEGER NOT NULL DEFAULT 0,
+    suggestions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, service_category, project_type, language, prompt_version)
+);
+
+-- how far every JSON Lines segment of the feedback log has been imported
+CREATE TABLE IF NOT EXISTS ingest_state (
+    source TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+"""
+
+
+# Function to find the day (UTC, YYYY-MM-DD) of a timestamp; records from the old feedback.json have none
+def day_of(timestamp):
+    if timestamp is None:
+        return "unknown"
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+
+# SQLite feedback repository: indexed feedback rows, daily like/dislike rollups and full text search of
+# suggestions (FTS5 when the SQLite build has it, LIKE otherwise). It is filled from the append-only
+# feedback log (see feedback_store.py), incrementally; the old feedback.json reaches it through the log.
+class FeedbackDB:
+    def __init__(self, path=FEEDBACK_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        try:
+            self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS suggestions_fts USING fts5(suggestion)")
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    # Insert feedback records (dicts as written by store_feedback) and update the rollups
+    def add_records(self, records):
+        with self._lock:
+            count = self._add_records(records)
+            self._db.commit()
+        return count
+
+    def _add_records(self, records):
+        count = 0
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            liked = str(record.get("liked_response") or "").strip().lower() or None
+            suggestion = (record.get("suggestion") or "").strip() or None
+            row = {
+                "recorded_at": record.get("recorded_at"),
+                "day": day_of(record.get("recorded_at")),
+                "your_name": record.get("your_name"),
+                "client_first_name": record.get("client_first_name"),
+                "client_last_name": record.get("client_last_name"),
+                "client_email": (record.get("client_email") or "").strip().lower() or None,
+                "liked_response": liked,
+                "language": " ".join(str(record.get("client_language") or record.get("language") or "").split()),
+                "project_type": " ".join(str(record.get("project_type") or "").split()),
+                "service_category": " ".join(str(record.get("service_category") or "").split()),
+                "prompt_version": str(record.get("prompt_version") or ""),
+                "email_response": record.get("email_response"),
+                "suggestion": suggestion,
+                "record": json.dumps(record, ensure_ascii=False),
+            }
+            cursor = self._db.execute(
+                f"INSERT INTO feedback ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                list(row.values()),
+            )
+            if suggestion and self.has_fts:
+                self._db.execute("INSERT INTO suggestions_fts (rowid, suggestion) VALUES (?, ?)",
+                                 (cursor.lastrowid, suggestion))
+            self._db.execute(
+                "INSERT INTO daily_rollups (day, service_category, project_type, language, prompt_version,"
+                " likes, dislikes, suggestions) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (day, service_category, project_type, language, prompt_version) DO UPDATE SET"
+                " likes = likes + excluded.likes, dislikes = dislikes + excluded.dislikes,"
+                " suggestions = suggestions + excluded.suggestions",
+                (row["day"], row["service_category"], row["project_type"], row["language"], row["prompt_version"],
+                 1 if liked == "yes" else 0, 1 if liked == "no" else 0, 1 if suggestion else 0),
+            )
+            count += 1
+        return count
+
+    # Import the new lines of every feedback log segment since the last sync; returns the number of records added
+    def sync_from_log(self, directory=FEEDBACK_DIR):
+        if not os.path.isdir(directory):
+            return 0
+        added = 0
+        with self._lock:
+            for name in sorted(os.listdir(directory)):
+                if not SEGMENT_PATTERN.match(name):
+                    continue
+                path = os.path.join(directory, name)
+                row = self._db.execute("SELECT position FROM ingest_state WHERE source = ?", (name,)).fetchone()
+                position = row[0] if row else 0
+                if os.path.getsize(path) <= position:
+                    continue
+                records = []
+                with open(path, "rb") as file:
+                    file.seek(position)
+                    for line in file:
+                        if not line.endswith(b"\n"):
+                            break  # a batch still being written; picked up by the next sync
+                        position += len(line)
+                        try:
+                            records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+                added += self._add_records(records)
+                self._db.execute("INSERT OR REPLACE INTO ingest_state (source, position) VALUES (?, ?)",
+                                 (name, position))
+                self._db.commit()
+        return added
+
+    # Like-rate per value of group_by for the days since_day..until_day (inclusive, YYYY-MM-DD), from the rollups
+    def like_rates(self, group_by="service_category", since_day=None, until_day=None):
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_COLUMNS)}")
+        conditions, params = [], []
+        if since_day:
+            conditions.append("day >= ?")
+            params.append(since_day)
+        if until_day:
+            conditions.append("day <= ?")
+            params.append(until_day)
+        where = ("WHERE day != 'unknown' AND " + " AND ".join(conditions)) if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {group_by}, SUM(likes), SUM(dislikes), SUM(suggestions) FROM daily_rollups {where}"
+                f" GROUP BY {group_by} ORDER BY {group_by}",
+                params,
+            ).fetchall()
+        return [
+            {group_by: group, "likes": likes, "dislikes": dislikes, "suggestions": suggestions,
+             "like_rate": round(likes / (likes + dislikes), 3) if likes + dislikes else None}
+            for group, likes, dislikes, suggestions in rows
+        ]
+
+    # Suggestions matching text, newest first
+    def search_suggestions(self, text, limit=20):
+        with self._lock:
+            if self.has_fts:
+                # every word is quoted so user input is never parsed as FTS syntax
+                query = " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+                rows = self._db.execute(
+                    "SELECT f.recorded_at, f.client_email, f.service_category, f.suggestion"
+                    " FROM suggestions_fts JOIN feedback f ON f.id = suggestions_fts.rowid"
+                    " WHERE suggestions_fts MATCH ? ORDER BY f.id DESC LIMIT ?",
+                    (query, limit),
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT recorded_at, client_email, service_category, suggestion FROM feedback"
+                    " WHERE suggestion LIKE ? ORDER BY id DESC LIMIT ?",
+                    ("%" + text + "%", limit),
+                ).fetchall()
+        return [
+            {"recorded_at": recorded_at, "client_email": email, "service_category": category, "suggestion": suggestion}
+            for recorded_at, email, category, suggestion in rows
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Feedback reports from the SQLite feedback repository.")
+    parser.add_argument("--db", default=FEEDBACK_DB_PATH, help="SQLite database file")
+    parser.add_argument("--log-dir", default=FEEDBACK_DIR, help="feedback log folder to sync from")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("sync", help="import new records from the feedback log")
+    import_parser = commands.add_parser("import", help="copy an old feedback.json file into the feedback log once")
+    import_parser.add_argument("path", nargs="?", default=LEGACY_FEEDBACK_FILE)
+    rate_parser = commands.add_parser("like-rate", help="like-rate per group over the last days")
+    rate_parser.add_argument("--by", default="service_category", choices=GROUP_COLUMNS)
+    rate_parser.add_argument("--days", type=int, default=7, help="number of days including today (0 = all time)")
+    search_parser = commands.add_parser("search", help="search the suggestions")
+    search_parser.add_argument("text")
+    search_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    db = FeedbackDB(args.db)
+    if args.command == "import":
+        # Into the log, with the same marker as the app's own import, so the records are never counted twice
+        store = FeedbackStore(args.log_dir)
+        copied = store.import_legacy(args.path)
+        store.close()
+        print(f"{copied} records copied to the feedback log")
+
+    # Reports always include the feedback written since the last run
+    added = db.sync_from_log(args.log_dir)
+    if args.command in ("sync", "import"):
+        print(f"{added} records imported")
+    elif args.command == "like-rate":
+        since = day_of(time.time() - (args.days - 1) * 86400) if args.days > 0 else None
+        for row in db.like_rates(args.by, since_day=since):
+            rate = "-" if row["like_rate"] is None else f"{row['like_rate']:.0%}"
+            print(f"{row[args.by] or '(none)'}: {rate} liked ({row['likes']} yes, {row['dislikes']} no, "
+                  f"{row['suggestions']} suggestions)")
+    elif args.command == "search":
+        for row in db.search_suggestions(args.text, args.limit):
+            print(f"[{day_of(row['recorded_at'])}] {row['client_email']} ({row['service_category']}): "
+                  f"{row['suggestion']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
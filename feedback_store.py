@@ -0,0 +1,230 @@
+import atexit  # flushing pending feedback when the process exits
+import json  # encoding one feedback record per line (JSON Lines)
+import logging  # reporting failed writes
+import os  # paths, file sizes and fsync
+import queue  # hand-off between the Streamlit sessions and the writer thread
+import re  # matching segment file names
+import threading  # background writer thread
+import time  # timestamps and flush intervals
+
+from metrics import get_metrics  # time spent writing feedback batches
+
+try:
+    import fcntl  # file locking on Linux / Mac
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+    import msvcrt  # file locking on Windows
+
+# Where the feedback segments are written and how big one segment may grow before we start a new one
+FEEDBACK_DIR = os.getenv("FEEDBACK_DIR", "feedback")
+SEGMENT_MAX_BYTES = int(os.getenv("FEEDBACK_SEGMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+LEGACY_FEEDBACK_FILE = "feedback.json"
+
+SEGMENT_PATTERN = re.compile(r"^feedback-(\d{6})\.jsonl$")
+
+# A batch that could not be written (disk full, permissions, lock) is retried after these delays, doubling up to
+# the maximum; when the store is closed it is given up after WRITE_ATTEMPTS_ON_CLOSE more attempts
+WRITE_RETRY_DELAY = 0.5
+WRITE_RETRY_MAX_DELAY = 30.0
+WRITE_ATTEMPTS_ON_CLOSE = 5
+
+logger = logging.getLogger(__name__)
+
+
+# Lock a file exclusively so that several processes never write the same segment at the same time
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10 seconds, keep waiting until the other writer is done
+                    continue
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+
+# Append-only feedback log: every record is one JSON line, records are written in batches by a
+# background thread and the log is split into numbered segments of at most segment_max_bytes
+class FeedbackStore:
+    def __init__(self, directory=FEEDBACK_DIR, segment_max_bytes=SEGMENT_MAX_BYTES,
+                 batch_size=100, flush_interval=0.5):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self.lock_path = os.path.join(directory, ".lock")
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run_writer, name="feedback-writer", daemon=True)
+        self._writer.start()
+
+    # Queue one feedback record; the cost does not depend on how much feedback is already stored
+    def append(self, feedback_data):
+        if self._closed:
+            raise RuntimeError("feedback store is closed")
+        record = dict(feedback_data)
+        record.setdefault("recorded_at", time.time())
+        self._queue.put(record)
+
+    # Block until everything queued so far has been written to disk
+    def flush(self):
+        self._queue.join()
+
+    # Stop the writer thread after writing whatever is still queued
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    # Read every record back in the order it was written, skipping lines that are not valid JSON
+    def iter_records(self):
+        for path in self.segment_paths():
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+    # All segment files, oldest first
+    def segment_paths(self):
+        names = sorted(name for name in os.listdir(self.directory) if SEGMENT_PATTERN.match(name))
+        return [os.path.join(self.directory, name) for name in names]
+
+    # One-time import of the old feedback.json list into the log (a marker file prevents a second import)
+    def import_legacy(self, legacy_path=LEGACY_FEEDBACK_FILE):
+        marker = os.path.join(self.directory, ".imported-" + os.path.basename(legacy_path))
+        if not os.path.exists(legacy_path) or os.path.exists(marker):
+            return 0
+        with FileLock(self.lock_path):
+            # Another process may have finished the import while we were waiting for the lock
+            if os.path.exists(marker):
+                return 0
+            with open(legacy_path, "r", encoding="utf-8") as file:
+                try:
+                    existing_data = json.load(file)
+                except json.JSONDecodeError:
+                    existing_data = []
+            if not isinstance(existing_data, list):
+                existing_data = []
+            records = [record for record in existing_data if isinstance(record, dict)]
+            if records:
+                self._write_locked(records)
+            with open(marker, "w", encoding="utf-8") as file:
+                file.write(str(len(records)))
+        return len(records)
+
+    # Writer thread: collect up to batch_size records (or whatever arrived within flush_interval) and write them together
+    def _run_writer(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch, stop)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+
+    # Write one batch, retrying with backoff until it is on disk, so flush() only returns once it really is
+    def _write_batch(self, batch, stopping):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with get_metrics().timed("feedback_disk_write"), FileLock(self.lock_path):
+                    self._write_locked(batch)
+                return
+            except Exception as e:
+                get_metrics().increment("feedback_write_errors_total")
+                if (stopping or self._closed) and attempt >= WRITE_ATTEMPTS_ON_CLOSE:
+                    get_metrics().increment("feedback_records_lost_total", len(batch))
+                    logger.error("Giving up on %d feedback records after %d attempts: %s", len(batch), attempt, e)
+                    return
+                delay = min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_DELAY * 2 ** (attempt - 1))
+                logger.warning("Writing %d feedback records failed (attempt %d), retrying in %.1fs: %s",
+                               len(batch), attempt, delay, e)
+                time.sleep(delay)
+
+    # Append records to the newest segment, starting a new segment when it is full (caller holds the lock)
+    def _write_locked(self, records):
+        payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        path = self._current_segment(len(payload))
+        with open(path, "ab") as file:
+            start = file.tell()
+            try:
+                file.write(payload)
+                file.flush()
+                os.fsync(file.fileno())
+            except BaseException:
+                # drop a partly written batch, the retry writes all of it again
+                file.truncate(start)
+                raise
+
+    def _current_segment(self, incoming_bytes):
+        paths = self.segment_paths()
+        if not paths:
+            return os.path.join(self.directory, "feedback-000001.jsonl")
+        latest = paths[-1]
+        size = os.path.getsize(latest)
+        if size > 0 and size + incoming_bytes > self.segment_max_bytes:
+            number = int(SEGMENT_PATTERN.match(os.path.basename(latest)).group(1)) + 1
+            return os.path.join(self.directory, f"feedback-{number:06d}.jsonl")
+        return latest
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Shared store for the whole process, so every Streamlit session goes through the same writer thread
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FeedbackStore()
+            _store.import_legacy()
+            atexit.register(_store.close)
+        return _store
@@ -0,0 +1,281 @@
+import json  # job payloads and results
+import os  # reading the queue settings from the environment
+import random  # jitter of the retry delays
+import sqlite3  # durable queue shared by every process on this machine
+import threading  # worker threads and waiting for a job
+import time  # priorities, retry delays and leases
+import uuid  # job ids
+
+from metrics import get_metrics  # queue depth and job outcomes
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # generations the worker pool of one process runs at a time
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "1000"))  # queued jobs above which new ones are refused
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))  # tries of a job that keeps hitting busy errors
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "30"))  # first delay before such a job is tried again (s)
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))  # a running job older than this is run again
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))  # finished jobs kept
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))  # how often jobs of other processes are looked for
+
+PENDING = ("queued", "running")
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Raised by a job handler when the job should be tried again later (the service was busy or unreachable)
+class RetryLater(Exception):
+    pass
+
+
+# Raised by a job handler when the job cannot succeed; the message is stored as the job's error
+class JobFailed(Exception):
+    pass
+
+
+# Durable job queue in SQLite. Jobs are claimed by priority (highest first), then in the order they were submitted.
+# A job submitted while an identical one (same dedup_key) is still queued or running is not added again; the id of
+# the existing one is returned. Waiting callers of this process are woken as soon as their job finishes, jobs
+# finished by other processes are noticed within JOB_POLL_SECONDS.
+class JobQueue:
+    def __init__(self, path=JOB_QUEUE_PATH, max_pending=JOB_MAX_PENDING, poll_seconds=JOB_POLL_SECONDS,
+                 lease_seconds=JOB_LEASE_SECONDS):
+        self.path = path
+        self.max_pending = max_pending
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()  # notified when a job is submitted or finished
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, dedup_key TEXT, priority INTEGER NOT NULL, status TEXT NOT NULL,"
+            " payload TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, available_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        # at most one pending job per dedup key; finished ones do not count
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending_dedup ON jobs (dedup_key)"
+                         " WHERE status IN ('queued', 'running')")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_next ON jobs (status, priority, created_at)")
+
+    # Add a job; returns (job id, False) or, when an identical job is pending, (its id, True). A duplicate with a
+    # higher priority raises the priority of the pending job. Raises QueueFull above max_pending queued jobs.
+    def submit(self, payload, priority=0, dedup_key=None):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if dedup_key is not None:
+                    row = self._db.execute(
+                        "SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running')", (dedup_key,),
+                    ).fetchone()
+                    if row is not None:
+                        self._db.execute("UPDATE jobs SET priority = MAX(priority, ?) WHERE id = ?", (priority, row[0]))
+                        self._db.execute("COMMIT")
+                        get_metrics().increment("jobs_submitted_total", outcome="deduplicated")
+                        return row[0], True
+                queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if queued >= self.max_pending:
+                    raise QueueFull(f"{queued} jobs are waiting already, please try again later")
+                job_id = uuid.uuid4().hex
+                self._db.execute(
+                    "INSERT INTO jobs (id, dedup_key, priority, status, payload, created_at, available_at)"
+                    " VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, dedup_key, priority, json.dumps(payload, ensure_ascii=False), now, now),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        get_metrics().increment("jobs_submitted_total", outcome="queued")
+        get_metrics().set_gauge("jobs_queued", queued + 1)
+        self.wake()
+        return job_id, False
+
+    # Take the next job that is due (or whose worker died, see lease_seconds) and mark it running.
+    # Returns (job id, payload, attempt) or None when there is nothing to do.
+    def claim(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, payload, attempts FROM jobs"
+                    " WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND started_at < ?)"
+                    " ORDER BY priority DESC, created_at LIMIT 1",
+                    (now, now - self.lease_seconds),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1"
+                                     " WHERE id = ?", (now, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def complete(self, job_id, result):
+        self._finish(job_id, "done", result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error=str(error))
+
+    # Put a running job back in the queue, due after delay seconds
+    def retry(self, job_id, error, delay):
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = 'queued', error = ?, available_at = ?, started_at = NULL"
+                             " WHERE id = ?", (str(error), now + delay, job_id))
+        get_metrics().increment("jobs_finished_total", outcome="retried")
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                             (status, result, error, time.time(), job_id))
+        get_metrics().increment("jobs_finished_total", outcome=status)
+        self.wake()
+
+    # The job as a dict (status, result, error, attempts, position in the queue, ...), or None for an unknown id
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, priority, status, result, error, attempts, created_at, available_at, started_at,"
+                " finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(("id", "priority", "status", "result", "error", "attempts", "created_at", "available_at",
+                            "started_at", "finished_at"), row))
+            job["position"] = None
+            if job["status"] == "queued":
+                # jobs that will be run before this one
+                job["position"] = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR"
+                    " (priority = ? AND created_at < ?))", (job["priority"], job["priority"], job["created_at"]),
+                ).fetchone()[0]
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    # Block until the job is done or failed, or timeout seconds have passed; returns the job (see get)
+    def wait(self, job_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] not in PENDING:
+                return job
+            left = self.poll_seconds if deadline is None else min(self.poll_seconds, deadline - time.monotonic())
+            if left <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(left)
+
+    # Block up to timeout seconds until something was submitted or finished in this process
+    def wait_for_change(self, timeout):
+        with self._changed:
+            self._changed.wait(timeout)
+
+    # Wake everything waiting in wait() or wait_for_change()
+    def wake(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    # Number of jobs per status
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    # Delete finished jobs older than max_age seconds; returns how many were deleted
+    def prune(self, max_age=JOB_RETENTION_SECONDS):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                      (time.time() - max_age,))
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Threads draining a JobQueue: every worker claims one job at a time and runs handler(payload) on it, so at most
+# `workers` jobs of this process run at once however many are queued. handler returns the result (stored as JSON),
+# raises RetryLater to run the job again after an exponential delay (up to max_attempts times), or raises any other
+# exception to fail it.
+class JobWorkerPool:
+    def __init__(self, queue, handler, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS,
+                 retry_delay=JOB_RETRY_DELAY):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.queue.prune()
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    # Stop taking new jobs; jobs already running are finished first
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.queue.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = self.queue.claim()
+            if claimed is None:
+                self.queue.wait_for_change(self.queue.poll_seconds)
+                continue
+            self.run_job(*claimed)
+
+    def run_job(self, job_id, payload, attempt):
+        try:
+            result = self.handler(payload)
+        except RetryLater as e:
+            if attempt >= self.max_attempts:
+                self.queue.fail(job_id, e)
+            else:
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                self.queue.retry(job_id, e, random.uniform(delay / 2, delay))
+            return
+        except Exception as e:
+            self.queue.fail(job_id, e)
+            return
+        self.queue.complete(job_id, result)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+# Shared queue for the whole process
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+# Worker pool of the whole process draining the shared queue with handler, started on the first call. Streamlit
+# re-runs the app script on every interaction, so the pool must live here and not in the script.
+def get_worker_pool(handler, workers=JOB_WORKERS):
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = JobWorkerPool(get_queue(), handler, workers)
+            _worker_pool.start()
+        return _worker_pool
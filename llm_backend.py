@@ -0,0 +1,71 @@
+import os  # choosing the backend from the environment
+
+import openai  # the real model backend
+import requests  # HTTP sessions of the openai library
+from requests.adapters import HTTPAdapter  # connection pool size
+
+
+# Interface every model backend implements: create() takes the same arguments as openai.ChatCompletion.create
+# and returns the same shapes, a response dict or, with stream=True, an iterator of delta chunks.
+# Errors are raised as openai.error exceptions so callers handle every backend the same way.
+class ChatBackend:
+    name = "base"
+
+    def create(self, model, messages, max_tokens=300, temperature=0.7, stream=False, **kwargs):
+        raise NotImplementedError
+
+
+# Backend calling the OpenAI API with its own key (and optionally another API base URL, e.g. the fake server)
+# instead of the module-global openai.api_key
+class OpenAIBackend(ChatBackend):
+    name = "openai"
+
+    def __init__(self, api_key=None, api_base=None, request_timeout=60):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.request_timeout = request_timeout
+
+    def create(self, model, messages, max_tokens=300, temperature=0.7, stream=False, **kwargs):
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        return openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=stream,
+            api_key=self.api_key,
+            request_timeout=self.request_timeout,
+            **kwargs
+        )
+
+
+# requests session shared by every thread; the openai library closes and replaces a thread's session every few
+# minutes, which must not tear down the connections the other threads are using
+class _SharedSession(requests.Session):
+    def close(self):
+        pass
+
+
+# Function to make every OpenAIBackend call of the process go through one keep-alive connection pool of up to
+# pool_size connections per host, instead of one session per thread. Servers call it once at startup.
+def use_connection_pool(pool_size):
+    session = _SharedSession()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    openai.requestssession = session
+    return session
+
+
+# Function to build the backend selected by LLM_BACKEND: "openai" (default, honours OPENAI_API_BASE)
+# or "fake" for the local deterministic stand-in configured by the FAKE_LLM_* variables (see fake_backend.py)
+def get_backend(api_key=None):
+    kind = os.getenv("LLM_BACKEND", "openai").lower()
+    if kind == "fake":
+        from fake_backend import FakeBackend  # only needed when the fake is selected
+
+        return FakeBackend.from_env()
+    if kind != "openai":
+        raise ValueError(f"Unknown LLM_BACKEND: {kind}")
+    return OpenAIBackend(api_key=api_key, api_base=os.getenv("OPENAI_API_BASE"))
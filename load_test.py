@@ -0,0 +1,222 @@
+import argparse  # command line options
+import json  # machine-readable report
+import os  # isolating the load test from the real feedback log
+import random  # choosing inquiries and answers of the virtual users
+import sys  # exit code for CI
+import tempfile  # throw-away feedback log
+import threading  # one thread per virtual user
+import time  # stage durations and latencies
+import uuid  # marking every feedback record sent
+
+# The feedback of the virtual users goes to a throw-away log; benchmark.py isolates the cache, index, usage log and
+# backend the same way, and has to be imported after this
+LOAD_TEST_DIR = tempfile.mkdtemp(prefix="smart-response-load-")
+os.environ["FEEDBACK_DIR"] = os.path.join(LOAD_TEST_DIR, "feedback")
+
+from benchmark import SAMPLE_INQUIRY, find_regressions, latency_summary, measure_stream  # noqa: E402
+import email_generator  # noqa: E402
+from fake_backend import FakeBackend, Latency  # noqa: E402
+from feedback_store import get_store  # noqa: E402
+
+MARKER_FIELD = "load_test_id"
+
+# Project details of the virtual users are put together from these, so only some of them are similar enough for a
+# liked reply to be reused
+FEATURES = [
+    "online booking", "payment gateway", "admin dashboard", "mobile app", "user accounts", "search filters",
+    "map view", "email notifications", "reviews and ratings", "multi-language content", "analytics reports",
+    "chat support", "inventory tracking", "loyalty programme", "CRM integration", "image gallery",
+]
+
+
+# One virtual user: generates an email, waits think_time, sends feedback on it and starts over until stop is set.
+# Every flow is appended to results as a dict; every feedback sent is remembered in sent (id -> email).
+class VirtualUser(threading.Thread):
+    def __init__(self, number, stop, results, sent, lock, settings, seed):
+        super().__init__(name=f"virtual-user-{number}", daemon=True)
+        self.number = number
+        self.stop = stop
+        self.results = results
+        self.sent = sent
+        self.lock = lock
+        self.settings = settings
+        self.rng = random.Random(seed)
+
+    def run(self):
+        iteration = 0
+        while not self.stop.is_set():
+            iteration += 1
+            self.results.append(self.flow(iteration))
+            if self.settings.think_time:
+                self.stop.wait(self.rng.uniform(0, 2 * self.settings.think_time))
+
+    def inquiry(self, iteration):
+        if self.rng.random() < self.settings.duplicate_share:
+            # a few inquiries everybody asks for, served by the cache or shared with a concurrent request
+            details = f"{SAMPLE_INQUIRY['project_details']} Shared inquiry {self.rng.randrange(5)}."
+        else:
+            features = ", ".join(self.rng.sample(FEATURES, 4))
+            details = f"I need a website with {features}. User {self.number} request {iteration}."
+        return dict(SAMPLE_INQUIRY, project_details=details)
+
+    def flow(self, iteration):
+        inquiry = self.inquiry(iteration)
+        flow = {"ok": False, "generate_seconds": None, "feedback_seconds": None, "error": None, "reused": False}
+        started = time.monotonic()
+        try:
+            if self.settings.stream:
+                _, _, email_response = measure_stream(email_generator.stream_email_response(**inquiry))
+            else:
+                result = email_generator.generate_for_inquiry(inquiry, use_history=self.settings.use_history)
+                flow["reused"] = result.reused
+                if not result.ok:
+                    flow["error"] = result.reason.split(":")[0]
+                    return flow
+                email_response = result.email_response
+        except Exception as e:
+            flow["error"] = type(e).__name__
+            return flow
+        flow["generate_seconds"] = time.monotonic() - started
+
+        feedback_id = uuid.uuid4().hex
+        liked_response = "yes" if self.rng.random() < self.settings.like_share else "no"
+        started = time.monotonic()
+        try:
+            email_generator.submit_feedback(dict(inquiry, **{MARKER_FIELD: feedback_id}), email_response,
+                                            liked_response, "" if liked_response == "yes" else "Shorter please.")
+        except Exception as e:
+            flow["error"] = "feedback " + type(e).__name__
+            return flow
+        flow["feedback_seconds"] = time.monotonic() - started
+        with self.lock:
+            self.sent[feedback_id] = email_response
+        flow["ok"] = True
+        return flow
+
+
+# Function to run one stage: `users` virtual users for `seconds` seconds
+def run_stage(users, seconds, settings, sent, lock, first_user=0):
+    stop = threading.Event()
+    results = []
+    started = time.monotonic()
+    threads = [VirtualUser(first_user + number, stop, results, sent, lock, settings, settings.seed + first_user + number)
+               for number in range(users)]
+    for thread in threads:
+        thread.start()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+
+    ok = [flow for flow in results if flow["ok"]]
+    errors = {}
+    for flow in results:
+        if flow["error"]:
+            errors[flow["error"]] = errors.get(flow["error"], 0) + 1
+    return {
+        "concurrency": users,  # named like the benchmark levels, so find_regressions compares them
+        "flows": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else None,
+        "error_kinds": errors,
+        "reused_replies": sum(1 for flow in ok if flow["reused"]),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else None,
+        **latency_summary([flow["generate_seconds"] for flow in ok]),
+        "feedback": latency_summary([flow["feedback_seconds"] for flow in ok]),
+    }
+
+
+# Function to check that every feedback record sent was written exactly once and unchanged. Also counts the lines
+# of the log that are not valid JSON.
+def check_feedback_log(store, sent):
+    found = {}
+    corrupted_lines = 0
+    changed = 0
+    for path in store.segment_paths():
+        with open(path, "rb") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    corrupted_lines += 1
+                    continue
+                feedback_id = record.get(MARKER_FIELD)
+                if feedback_id is None:
+                    continue
+                found[feedback_id] = found.get(feedback_id, 0) + 1
+                if feedback_id in sent and record.get("email_response") != sent[feedback_id]:
+                    changed += 1
+    return {
+        "sent": len(sent),
+        "stored": sum(1 for feedback_id in sent if feedback_id in found),
+        "lost": sum(1 for feedback_id in sent if feedback_id not in found),
+        "duplicated": sum(1 for count in found.values() if count > 1),
+        "changed": changed,
+        "corrupted_lines": corrupted_lines,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the generate-then-feedback flow against the fake "
+                                                 "model backend.")
+    parser.add_argument("--users", default="1,5,10,25", help="comma separated virtual users per stage (ramp)")
+    parser.add_argument("--stage-seconds", type=float, default=10.0, help="duration of every stage")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause of a user between two flows (s)")
+    parser.add_argument("--duplicate-share", type=float, default=0.1, help="share of flows asking a shared inquiry")
+    parser.add_argument("--like-share", type=float, default=0.5, help="share of emails answered with yes")
+    parser.add_argument("--stream", action="store_true", help="generate through the streaming path")
+    parser.add_argument("--no-history", dest="use_history", action="store_false",
+                        help="do not reuse liked replies to similar inquiries")
+    parser.add_argument("--latency", type=float, default=0.5, help="mean time to first token of the fake (s)")
+    parser.add_argument("--latency-spread", type=float, default=0.2)
+    parser.add_argument("--latency-distribution", default="lognormal",
+                        choices=["constant", "uniform", "normal", "lognormal"])
+    parser.add_argument("--token-latency", type=float, default=0.002, help="seconds between two fake tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake requests that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --output file; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    args = parser.parse_args(argv)
+
+    email_generator.chat_api = FakeBackend(Latency(args.latency, args.latency_spread, args.latency_distribution),
+                                           token_latency=args.token_latency, error_rate=args.error_rate,
+                                           seed=args.seed)
+    report = {"settings": vars(args).copy(), "levels": []}
+    sent = {}
+    lock = threading.Lock()
+    first_user = 0
+    for users in [int(users) for users in args.users.split(",")]:
+        level = run_stage(users, args.stage_seconds, args, sent, lock, first_user)
+        first_user += users
+        report["levels"].append(level)
+        print(f"{level['concurrency']:>4} users: {level['throughput_rps']} flows/s, p50 {level['p50_ms']}ms, "
+              f"p95 {level['p95_ms']}ms, p99 {level['p99_ms']}ms, feedback p95 {level['feedback']['p95_ms']}ms, "
+              f"{level['errors']} errors, {level['reused_replies']} reused replies")
+
+    get_store().flush()
+    report["feedback_log"] = check_feedback_log(get_store(), sent)
+    integrity = report["feedback_log"]
+    print(f"feedback log: {integrity['stored']}/{integrity['sent']} stored, {integrity['lost']} lost, "
+          f"{integrity['duplicated']} duplicated, {integrity['changed']} changed, "
+          f"{integrity['corrupted_lines']} corrupted lines")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+
+    failed = integrity["lost"] or integrity["duplicated"] or integrity["changed"] or integrity["corrupted_lines"]
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = find_regressions(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        failed = failed or regressions
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+import bisect  # finding the histogram bucket of an observation
+import cProfile  # optional profile of a generation
+import logging  # reporting an export that could not be started
+import os  # reading the metrics settings from the environment
+import threading  # metrics are updated by every Streamlit session and worker of the process
+import time  # durations and the export interval
+import tracemalloc  # optional peak memory of a generation
+from collections import deque  # rolling window of recent requests
+from contextlib import contextmanager  # timing and profiling blocks of code
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Prometheus scrape endpoint
+
+# Where the Prometheus text is exported: a file rewritten every METRICS_FILE_INTERVAL seconds and/or an HTTP
+# endpoint (GET /metrics) on METRICS_PORT. Both are off unless configured.
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+logger = logging.getLogger(__name__)
+
+# Number of recent requests summarised by the in-app stats panel
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "200"))
+
+# Profiling switch: with METRICS_PROFILE=1 every generation (one at a time) is run under cProfile and tracemalloc,
+# the profiles are written to METRICS_PROFILE_DIR and can be read with `python -m pstats <file>`
+PROFILE_ENABLED = os.getenv("METRICS_PROFILE", "").strip().lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", "profiles")
+
+# Estimated price in dollars per 1000 tokens: model -> (prompt, completion)
+PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4": (0.03, 0.06),
+}
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "smart_response"
+
+
+# Function to compute the q-th percentile (0-100) of a list of numbers with the nearest-rank method
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))  # ceil without floats
+    return ordered[int(rank) - 1]
+
+
+# Function to estimate the price of one request in dollars (0 for models without a known price)
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+# Cumulative histogram in the Prometheus sense: a count per bucket upper bound, plus the sum and count
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+# Metrics of the generation hot path: counters and histograms exported in the Prometheus text format, and the
+# last METRICS_WINDOW requests for the in-app stats panel
+class Metrics:
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._gauges = {}  # (name, labels) -> value
+        self.recent = deque(maxlen=window)
+        self.recent_stages = deque(maxlen=window * 4)
+        self._profile_lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # Record how long one stage (startup, prompt, api_call, feedback_write, ...) took
+    def observe_stage(self, stage, seconds):
+        self.observe("stage_seconds", seconds, stage=stage)
+        with self._lock:
+            self.recent_stages.append((stage, seconds))
+
+    # Time the block as one stage
+    @contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started)
+
+    # Record one finished request. outcome is "success", "retried" or "failed"; cache is "hit" (response cache),
+    # "reused" (liked reply to a similar inquiry) or "miss" (the model was called)
+    def record_request(self, model, seconds, outcome, cache, attempts=0, prompt_tokens=0, completion_tokens=0,
+                       stream=False):
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        mode = "stream" if stream else "complete"
+        self.increment("requests_total", outcome=outcome, cache=cache, mode=mode)
+        self.observe("request_seconds", seconds, cache=cache, mode=mode)
+        if attempts > 1:
+            self.increment("retries_total", attempts - 1)
+        if prompt_tokens:
+            self.increment("tokens_total", prompt_tokens, model=model, kind="prompt")
+        if completion_tokens:
+            self.increment("tokens_total", completion_tokens, model=model, kind="completion")
+        if cost:
+            self.increment("cost_dollars_total", cost, model=model)
+        with self._lock:
+            self.recent.append({
+                "time": time.time(), "seconds": seconds, "outcome": outcome, "cache": cache, "attempts": attempts,
+                "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cost": cost,
+            })
+
+    # Summary of the recent requests for the stats panel
+    def summary(self):
+        with self._lock:
+            recent = list(self.recent)
+            stages = list(self.recent_stages)
+        if not recent:
+            return {"requests": 0}
+        latencies = [request["seconds"] for request in recent]
+        stage_times = {}
+        for stage, seconds in stages:
+            stage_times.setdefault(stage, []).append(seconds)
+        return {
+            "requests": len(recent),
+            "errors": sum(1 for request in recent if request["outcome"] == "failed"),
+            "cache_hit_rate": sum(1 for request in recent if request["cache"] != "miss") / len(recent),
+            "retries": sum(max(0, request["attempts"] - 1) for request in recent),
+            "p50_seconds": percentile(latencies, 50),
+            "p95_seconds": percentile(latencies, 95),
+            "prompt_tokens": sum(request["prompt_tokens"] for request in recent),
+            "completion_tokens": sum(request["completion_tokens"] for request in recent),
+            "cost": sum(request["cost"] for request in recent),
+            "stages": {stage: {"count": len(times), "p50_seconds": percentile(times, 50),
+                               "p95_seconds": percentile(times, 95)}
+                       for stage, times in sorted(stage_times.items())},
+        }
+
+    # All metrics in the Prometheus text exposition format
+    def render_prometheus(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count, h.buckets))
+                                for key, h in self._histograms.items())
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value:g}")
+        for (name, labels), value in gauges:
+            declare(name, "gauge")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value:g}")
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    # Write the Prometheus text to a file; the file is replaced atomically so a scraper never reads half of it
+    def write_prometheus(self, path):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(self.render_prometheus())
+        os.replace(temporary, path)
+
+    # Run the block under cProfile and tracemalloc when profiling is switched on. Only one block is profiled at a
+    # time (the profilers are process-wide); blocks started meanwhile run without profiling.
+    @contextmanager
+    def profiled(self, name):
+        if not PROFILE_ENABLED or not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        profile = cProfile.Profile()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            self.set_gauge("profile_peak_bytes", peak, block=name)
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile.dump_stats(os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-"
+                                                         f"{threading.get_ident()}.prof"))
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            self._profile_lock.release()
+
+
+# HTTP handler answering GET /metrics with the Prometheus text of `metrics`
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = self.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would fill the log
+
+
+# Function to start the configured exports: the /metrics endpoint on `port` and a thread rewriting `path` every
+# `interval` seconds. Returns the HTTP server, or None when no port is configured.
+def start_exporter(metrics, path=METRICS_FILE, port=METRICS_PORT, interval=METRICS_FILE_INTERVAL, host="0.0.0.0"):
+    server = None
+    if port:
+        handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    if path:
+        def write_forever():
+            while True:
+                try:
+                    metrics.write_prometheus(path)
+                except OSError as e:
+                    print(f"Error writing metrics: {str(e)}")
+                time.sleep(interval)
+
+        threading.Thread(target=write_forever, name="metrics-file", daemon=True).start()
+    return server
+
+
+_metrics = Metrics()
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+
+# Shared metrics for the whole process
+def get_metrics():
+    return _metrics
+
+
+# Function to start the configured exports of this process once; only processes serving requests call it (the
+# Streamlit app and every HTTP API worker). worker numbers the API worker processes: each one exports on
+# METRICS_PORT + worker and to METRICS_FILE with "-<worker>" before the extension, so they do not collide.
+def start_process_exporter(worker=None):
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+    path, port = METRICS_FILE, METRICS_PORT
+    if worker is not None:
+        root, extension = os.path.splitext(path)
+        path = f"{root}-{worker}{extension}" if path else path
+        port = port + worker if port else port
+    try:
+        start_exporter(get_metrics(), path=path, port=port)
+    except OSError as e:
+        # e.g. the port is taken by another process; the app and API keep working without the export
+        logger.warning("Could not start the metrics export on port %s: %s", port, e)
@@ -0,0 +1,191 @@
+import json  # routing rules and the decision log
+import os  # reading the router settings from the environment
+import threading  # the router is shared by every session of the process
+import time  # rolling window of observed calls
+from collections import deque  # recent calls per model
+
+from metrics import get_metrics, percentile  # failover counters and latency percentiles
+
+# Routing rules: the first rule whose conditions all match the inquiry gives the models to try, in order. Conditions
+# are optional: "languages" and "service_categories" (lower case), "min_tokens" / "max_tokens" (size of the project
+# details in tokens). "order": "fastest" tries the healthy models with the lowest observed median latency first,
+# otherwise they are tried in the order listed. A model is only left for another one when it has degraded
+# (see ModelRouter) or its call failed. Replace the defaults with a JSON file {"rules": [...]} (MODEL_ROUTES_FILE);
+# the default only uses gpt-3.5-turbo, fallback models (and their cost) have to be chosen there.
+DEFAULT_RULES = [
+    {"name": "default", "models": ["gpt-3.5-turbo"]},
+]
+ROUTES_FILE = os.getenv("MODEL_ROUTES_FILE", "model_routes.json")
+
+# Rolling health of every model: calls of the last ROUTER_WINDOW_SECONDS count; with at least ROUTER_MIN_CALLS of
+# them, a model failing more than ROUTER_MAX_ERROR_RATE of its calls (or slower than a rule's "max_p95_seconds")
+# is tried after the healthy ones
+ROUTER_WINDOW_SECONDS = float(os.getenv("ROUTER_WINDOW_SECONDS", "300"))
+ROUTER_MIN_CALLS = int(os.getenv("ROUTER_MIN_CALLS", "5"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+
+# Attempts on one model before failing over to the next one; the last model of a route gets all the usual retries
+ROUTER_ATTEMPTS_PER_MODEL = int(os.getenv("ROUTER_ATTEMPTS_PER_MODEL", "2"))
+
+# One line per routed request: the features, the rule, the order the models were tried in with their health,
+# the model that answered and the outcome
+ROUTING_LOG_PATH = os.getenv("ROUTING_LOG", "routing_decisions.jsonl")
+
+
+# Function to read the routing rules from path, or the defaults when there is no such file
+def load_rules(path=None):
+    path = ROUTES_FILE if path is None else path
+    if not path or not os.path.exists(path):
+        return DEFAULT_RULES
+    with open(path, "r", encoding="utf-8") as file:
+        rules = json.load(file)["rules"]
+    for rule in rules:
+        if not rule.get("models"):
+            raise ValueError(f"Routing rule {rule.get('name')!r} has no models")
+    return rules
+
+
+# Function to check whether an inquiry's features meet a rule's conditions
+def rule_matches(rule, features):
+    if "languages" in rule and features["language"] not in rule["languages"]:
+        return False
+    if "service_categories" in rule and features["service_category"] not in rule["service_categories"]:
+        return False
+    if "min_tokens" in rule and features["details_tokens"] < rule["min_tokens"]:
+        return False
+    if "max_tokens" in rule and features["details_tokens"] > rule["max_tokens"]:
+        return False
+    return True
+
+
+# The models one request will try, in order, and why
+class Route:
+    def __init__(self, rule, models, features, health):
+        self.rule = rule
+        self.models = models
+        self.features = features
+        self.health = health  # model -> health at the time of the decision
+
+    @property
+    def model(self):
+        return self.models[0]
+
+
+# Chooses the models for every request from the routing rules and the recent health of every model, and fails
+# over to the next model when a call fails with a transient error
+class ModelRouter:
+    def __init__(self, rules=None, window_seconds=ROUTER_WINDOW_SECONDS, min_calls=ROUTER_MIN_CALLS,
+                 max_error_rate=ROUTER_MAX_ERROR_RATE, log_path=None):
+        self.rules = load_rules() if rules is None else rules
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self.log_path = ROUTING_LOG_PATH if log_path is None else log_path
+        self._calls = {}  # model -> deque of (time, seconds, ok)
+        self._lock = threading.Lock()
+
+    # Record one call of a model: its latency (seconds) and whether it succeeded
+    def record(self, model, seconds, ok):
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls.setdefault(model, deque())
+            calls.append((now, seconds, ok))
+            while calls and calls[0][0] < now - self.window_seconds:
+                calls.popleft()
+
+    # Rolling health of a model: number of calls, error rate and latency percentiles of the successful ones
+    def health(self, model, max_p95_seconds=None):
+        now = time.monotonic()
+        with self._lock:
+            calls = [call for call in self._calls.get(model, ()) if call[0] >= now - self.window_seconds]
+        latencies = [seconds for _, seconds, ok in calls if ok]
+        errors = sum(1 for _, _, ok in calls if not ok)
+        error_rate = errors / len(calls) if calls else 0.0
+        p50 = percentile(latencies, 50) if latencies else None
+        p95 = percentile(latencies, 95) if latencies else None
+        degraded = len(calls) >= self.min_calls and (
+            error_rate > self.max_error_rate or (max_p95_seconds is not None and p95 is not None
+                                                 and p95 > max_p95_seconds))
+        return {"calls": len(calls), "error_rate": round(error_rate, 3),
+                "p50_seconds": None if p50 is None else round(p50, 3),
+                "p95_seconds": None if p95 is None else round(p95, 3), "degraded": degraded}
+
+    # Function to pick the models for an inquiry; details_tokens is the size of its project details in tokens
+    def route(self, inquiry, details_tokens):
+        features = {
+            "language": str(inquiry.get("client_language") or "").strip().lower(),
+            "service_category": str(inquiry.get("service_category") or "").strip().lower(),
+            "details_tokens": details_tokens,
+        }
+        rule = next((rule for rule in self.rules if rule_matches(rule, features)), self.rules[-1])
+        health = {model: self.health(model, rule.get("max_p95_seconds")) for model in rule["models"]}
+        healthy = [model for model in rule["models"] if not health[model]["degraded"]]
+        if rule.get("order") == "fastest":
+            # models without a measurement yet come first, so every model gets measured
+            healthy.sort(key=lambda model: health[model]["p50_seconds"] or 0.0)
+        degraded = [model for model in rule["models"] if health[model]["degraded"]]
+        return Route(rule.get("name", ""), healthy + degraded, features, health)
+
+    # Run fn(model) for the models of route in order until one succeeds. fn returns (value, attempts) like
+    # rate_limiter.call_with_retries; an error for which is_transient(error) is false ends the search at once and
+    # does not count against the model's health (a bad key or our own exhausted quota says nothing about it).
+    # Returns (value, attempts of all models, model). With stream=True the latency of the call is not recorded
+    # (it only opens the stream), the caller records the time to the first token with record().
+    def call(self, route, fn, is_transient, stream=False):
+        attempts = 0
+        error = None
+        for position, model in enumerate(route.models):
+            started = time.monotonic()
+            try:
+                value, model_attempts = fn(model)
+            except Exception as e:
+                attempts += getattr(e, "attempts", 1)
+                error = e
+                if not is_transient(e):
+                    break
+                self.record(model, time.monotonic() - started, False)
+                if position == len(route.models) - 1:
+                    break
+                get_metrics().increment("route_failovers_total", model=model)
+                continue
+            if not stream:
+                self.record(model, time.monotonic() - started, True)
+            attempts += model_attempts
+            self.log(route, model, "success", attempts, time.monotonic() - started, failovers=position)
+            return value, attempts, model
+        error.attempts = attempts
+        self.log(route, None, type(error).__name__, attempts, None, failovers=position)
+        raise error
+
+    # Append one routing decision and its outcome to the decision log
+    def log(self, route, model, outcome, attempts, seconds, failovers=0):
+        if not self.log_path:
+            return
+        record = {
+            "time": time.time(),
+            "rule": route.rule,
+            "features": route.features,
+            "candidates": route.models,
+            "health": route.health,
+            "model": model,  # the model that answered, None when every one failed
+            "failovers": failovers,  # models given up on before this one
+            "outcome": outcome,
+            "attempts": attempts,
+            "seconds": None if seconds is None else round(seconds, 3),
+        }
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+# Shared router for the whole process
+def get_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
@@ -1,18 +1,20 @@
 import openai    #interacting with the open ai 
 import os           # to interact with the os and to read the evn variable 
 import streamlit as st    #  for  web interface 
-import json             # hadeling json files 
 
 from dotenv import load_dotenv   # to read the  variables  from evn file 
 
-# Load environment variables from the .env file
+# Load environment variables from the .env file, before the modules below read their settings
 load_dotenv()
 
+from feedback_store import get_store   # append-only feedback log
+from llm_backend import get_backend   # open ai or the local fake backend
+
 # Retrieve the API key from the environment
 my_key = os.getenv("MY_KEY")
 
-# seting my open ai  jey 
-openai.api_key = my_key
+# model backend using my open ai key (LLM_BACKEND=fake for the local fake)
+chat_api = get_backend(my_key)
 
 # Function to generate the email response using chat models (gpt-3.5-turbo or gpt-4)
 def generate_email_response(client_first_name, client_last_name, client_email, client_country, client_language, 
@@ -40,8 +42,8 @@ def generate_email_response(client_first_name, client_last_name, client_email, c
 
     # Try to make the API call to OpenAI
     try:
-        # Using openai.ChatCompletion.create() for chat models like gpt-3.5-turbo
-        response = openai.ChatCompletion.create(
+        # Using the backend create() (same arguments as openai.ChatCompletion.create()) for chat models like gpt-3.5-turbo
+        response = chat_api.create(
             model="gpt-3.5-turbo",  
             messages=[{"role": "user", "content": prompt}],
             max_tokens=300,  # this is the maximum number of words of email to be generated  
@@ -96,18 +98,9 @@ def collect_feedback(your_name, client_first_name, client_last_name, client_emai
 
 
 
-# Function to store feedback in JSON format
+# Function to store feedback in the shared append-only log (see feedback_store.py)
 def store_feedback(feedback_data):
-    # Storing feedback in JSON format
-    if os.path.exists("feedback.json"):
-        with open("feedback.json", "r") as file:
-            existing_data = json.load(file)
-    else:
-        existing_data = []
-
-    existing_data.append(feedback_data)
-    with open("feedback.json", "w") as file:
-        json.dump(existing_data, file, indent=4)
+    get_store().append(feedback_data)
 
 # Function to collect the 'Yes' or 'No' feedback separately
 def collect_liked_feedback():
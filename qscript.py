@@ -1,121 +1,189 @@
-import openai  # interacting with the OpenAI API
-import os  # to interact with the os and to read the env variable
+import time  # request durations for the metrics
 import streamlit as st  # for the web interface
-import json  # handling JSON files
-from dotenv import load_dotenv  # to read the variables from the .env file
-
-# Load environment variables from the .env file
-load_dotenv()
-
-# Retrieve the API key from the environment
-my_key = os.getenv("MY_KEY")
-
-# Setting OpenAI API key
-openai.api_key = my_key
-
-# Function to generate the email response using chat models (gpt-3.5-turbo or gpt-4)
-def generate_email_response(client_first_name, client_last_name, client_email, client_country, client_website,client_language, project_type, service_category, project_details, budget, your_name):
-    # This prompt is going to explain to the AI what kind of response to generate, including tone and content.
-    prompt = f"""
-    You are a professional consultant. You have received a project inquiry with the following details:
-
-    - Client First Name: {client_first_name}
-    - Client Last Name: {client_last_name}
-    - Client Email: {client_email}
-    - Client Country: {client_country}
-    - Client Website: {client_website}
-    - Client Language: {client_language}
-    - Project Type: {project_type}
-    - Service Category: {service_category}
-    - Project Details: {project_details}
-    - Budget: {budget}
-
-    Please generate a professional and human-like email response in {client_language}. Confirm the project details, provide a summary, and suggest next steps. Avoid generic phrases like "I hope this email finds you well." The response should sound natural and personalized. Address the email using {your_name}. Also mention about the website  preferd also {client_website} , in the response make sure to  mention the phrase best regards from {your_name} at the end of all the responses  , write the subject also for all the responses 
-    """
-
-    # Try to make the API call to OpenAI
-    try:
-        # Using openai.ChatCompletion.create() for chat models like gpt-3.5-turbo
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=300,  # this is the maximum number of words of email to be generated
-            temperature=0.3  # lower the value of this it will give more precise and accurate response in the email
-        )
-
-        # Extracting the email response text
-        email_response = response['choices'][0]['message']['content'].strip()
-
-        return email_response
-
-    except openai.error.InvalidRequestError as e:
-        return f"Invalid Request Error: {str(e)}"
-    except openai.error.AuthenticationError as e:
-        return f"Authentication Error: Please check your API key. {str(e)}"
-    except openai.error.RateLimitError as e:
-        return f"Rate Limit Error: You have hit the rate limit. {str(e)}"
-    except Exception as e:
-        return f"Error generating response: {str(e)}"
+from email_generator import (BUSY_ERRORS, LANGUAGES, MAX_CANDIDATES, MODEL, GenerationResult, build_inquiry,
+                             describe_error, enqueue_generation, find_similar_replies, generate_language_variants,
+                             start_job_workers, stream_email_response,
+                             submit_feedback)  # generation core, shared with the HTTP API
+from metrics import get_metrics, start_process_exporter  # stage timings, usage, stats panel and Prometheus export
+from job_queue import JOB_POLL_SECONDS, PENDING, QueueFull, get_queue  # emails queued while the service was busy
 
 
-# Function to collect feedback from users and store it in a file (JSON)
-def collect_feedback(your_name, client_first_name, client_last_name, client_email, email_response):
-    st.markdown("### If you didn’t like the response, please fill in the feedback below.")
+# Function to collect the 'Yes' or 'No' feedback; nothing is preselected, so only a real answer is stored
+def collect_liked_feedback():
+    liked_response = st.radio("did you  like the response", ["yes", "no"], index=None, horizontal=True)
+    return liked_response
+
 
-    # Display a suggestion text area for feedback
-    suggestion = st.text_area("Please provide your suggestions on how we can improve the response:", height=200)
+# Function to collect feedback from users and store it. The yes/no answer and the suggestion are submitted together
+# in one form, so choosing an answer or typing a suggestion does not rerun the script until "Submit Feedback".
+def collect_feedback(generation, form_key):
+    if generation["feedback_sent"]:
+        st.success("Feedback submitted successfully!")
+        return
 
-    # Button to submit the feedback
-    submit_button = st.button("Submit Feedback")
+    st.markdown("### Did you like the response? If not, please tell us how to improve it.")
+    with st.form(f"feedback_form_{form_key}"):
+        liked_response = collect_liked_feedback()
+        # Display a suggestion text area for feedback
+        suggestion = st.text_area("Please provide your suggestions on how we can improve the response:", height=200)
+        # Button to submit the feedback
+        submit_button = st.form_submit_button("Submit Feedback")
 
     # If the submit button is clicked, store the feedback
     if submit_button:
-        feedback_data = {
-            "your_name": your_name,
-            "client_first_name": client_first_name,
-            "client_last_name": client_last_name,
-            "client_email": client_email,
-            "email_response": email_response,
-            "suggestion": suggestion  # Saving the suggestion (can be empty if no suggestion is provided)
-        }
-        store_feedback(feedback_data)
+        if liked_response is None and not suggestion.strip():
+            st.warning("Please choose yes or no, or write a suggestion.")
+            return
+        submit_feedback(generation["inquiry"], generation["email_response"], liked_response, suggestion)
+        generation["feedback_sent"] = True
+        generation["liked_response"] = liked_response
         st.success("Feedback submitted successfully!")  # Displaying success message
 
-    return suggestion
-
-# Function to store feedback in JSON format
-def store_feedback(feedback_data):
-    # Check if the feedback.json file exists
-    if os.path.exists("feedback.json"):
-        # If the file exists, open and read its content
-        with open("feedback.json", "r") as file:
-            try:
-                existing_data = json.load(file)
-                # Ensure that existing_data is a list (in case it's empty, initialize it as an empty list)
-                if not isinstance(existing_data, list):
-                    existing_data = []
-            except json.JSONDecodeError:
-                # If the JSON file is empty or malformed, reset it to an empty list
-                existing_data = []
+
+# Function to stream the email response into the page while it is generated; returns (the finished email, None),
+# or (None, the exception) after showing the error. Busy errors are not shown, the caller queues the email instead.
+def show_streamed_response(inquiry, use_cache, examples=None):
+    response_placeholder = st.empty()
+    email_response = ""
+    try:
+        for text in stream_email_response(**inquiry, use_cache=use_cache, examples=examples):
+            email_response += text
+            response_placeholder.markdown(email_response + " ▌")
+    except Exception as e:
+        if isinstance(e, BUSY_ERRORS):
+            response_placeholder.empty()
+        else:
+            response_placeholder.error(describe_error(e))
+        return None, e
+    response_placeholder.empty()
+    return email_response.strip(), None
+
+
+# Function to generate the email in several languages at once, showing every language as soon as it is done;
+# returns one variant per language (see run), failed languages carry the error instead of an email.
+# candidates > 1 generates that many versions of every language in one call each and keeps the alternatives.
+def show_language_variants(inquiry, languages, regenerate, candidates=1):
+    placeholders = {language: st.empty() for language in languages}
+    for language, placeholder in placeholders.items():
+        placeholder.info(f"Writing the {language} email...")
+    variants = {}
+    for language, result in generate_language_variants(inquiry, languages, use_cache=not regenerate,
+                                                       reuse=not regenerate, candidates=candidates):
+        variants[language] = new_variant(dict(inquiry, client_language=language), result.email_response,
+                                          result.similarity if result.reused else 0.0,
+                                          None if result.ok else result.reason, result.alternatives)
+        if result.ok:
+            placeholders[language].markdown(f"**{language}**\n\n{result.email_response}")
+        elif result.retryable:
+            variants[language] = queue_variant(dict(inquiry, client_language=language), use_cache=not regenerate,
+                                               candidates=candidates)
+        else:
+            placeholders[language].error(f"{language}: {result.reason}")
+    for placeholder in placeholders.values():
+        placeholder.empty()
+    return [variants[language] for language in languages]
+
+
+# Function to build the session state of one generated email (one per language)
+def new_variant(inquiry, email_response, reused_similarity=0.0, error=None, alternatives=(), job_id=None):
+    return {
+        "language": inquiry["client_language"],
+        "inquiry": inquiry,
+        "email_response": email_response,
+        "reused_similarity": reused_similarity,
+        "error": error,
+        "job_id": job_id,  # outbox job still writing this email (see queue_variant)
+        "alternatives": list(alternatives),  # other candidates of the same call, best first
+        "version": 0,  # how many alternatives were shown so far
+        "feedback_sent": False,
+        "liked_response": None,
+    }
+
+
+# Function to queue an email the service was too busy to write; returns its variant, which shows the email once
+# the outbox has written it (see show_queued_variant)
+def queue_variant(inquiry, use_cache=True, candidates=1):
+    try:
+        job_id, _ = enqueue_generation(inquiry, use_cache=use_cache, candidates=candidates)
+    except QueueFull as e:
+        return new_variant(inquiry, "", error=f"The service is busy and the queue is full: {e}")
+    return new_variant(inquiry, "", job_id=job_id)
+
+
+# Function to show a queued email while it waits; checks the outbox every JOB_POLL_SECONDS (only this part of the
+# page reruns) and shows the whole page again as soon as the job has finished
+@st.fragment(run_every=max(JOB_POLL_SECONDS, 1.0))
+def show_queued_variant(variant):
+    job = get_queue().get(variant["job_id"])
+    if job is not None and job["status"] in PENDING:
+        waiting = "is being written" if job["status"] == "running" else f"is number {job['position'] + 1} in the queue"
+        st.info(f"The service is busy right now, so the {variant['language']} email was queued and {waiting}. "
+                "It will appear here when it is ready; it is also kept if you close this page.")
+        return
+    variant["job_id"] = None
+    if job is None:
+        variant["error"] = "The queued email was lost, please generate it again."
+    elif job["status"] == "failed":
+        variant["error"] = f"The queued email could not be written: {job['error']}"
     else:
-        # If the file doesn't exist, initialize it as an empty list
-        existing_data = []
+        result = GenerationResult(**job["result"])
+        variant["email_response"] = result.email_response
+        variant["alternatives"] = list(result.alternatives)
+    st.rerun()
 
-    # Append the new feedback data to the list
-    existing_data.append(feedback_data)
 
-    # Save the updated list back to the feedback.json file
-    with open("feedback.json", "w") as file:
-        json.dump(existing_data, file, indent=4)
+# Function to show one generated email with its feedback form; after a "no" the next alternative, if any, can be
+# shown at once without calling the model again
+def show_variant(generation, variant, multiple):
+    form_key = f"{generation['id']}_{variant['language']}_{variant['version']}"
+    if multiple:
+        st.markdown(f"#### {variant['language']}")
+    if variant["error"]:
+        st.error(variant["error"])
+        return
+    if variant["job_id"]:
+        show_queued_variant(variant)
+        return
+    if variant["reused_similarity"]:
+        st.info(f"Reused a reply you liked for a very similar inquiry ({variant['reused_similarity']:.0%} similar). "
+                "Click \"Regenerate Email Response\" for a new one.")
+    st.text_area("Email Response", variant["email_response"], height=250, key=f"email_response_area_{form_key}")
+
+    # Collect "Did you like the response?" and suggestions for improvement
+    collect_feedback(variant, form_key)
+
+    if variant["feedback_sent"] and variant["liked_response"] == "no" and variant["alternatives"]:
+        if st.button(f"Show another version ({len(variant['alternatives'])} left)", key=f"alternative_{form_key}"):
+            variant["email_response"] = variant["alternatives"].pop(0)
+            variant["version"] += 1
+            variant["feedback_sent"] = False
+            variant["liked_response"] = None
+            st.rerun()
+
+
+# Function to show the stats of the recent requests of this server process in the sidebar
+def show_stats_panel():
+    stats = get_metrics().summary()
+    with st.sidebar.expander(f"Stats (last {stats['requests']} requests)"):
+        if not stats["requests"]:
+            st.write("No requests yet.")
+            return
+        st.metric("p50 / p95 latency", f"{stats['p50_seconds']:.2f}s / {stats['p95_seconds']:.2f}s")
+        st.metric("Cache and history hits", f"{stats['cache_hit_rate']:.0%}")
+        st.metric("Errors / retries", f"{stats['errors']} / {stats['retries']}")
+        st.metric("Tokens (prompt + completion)", f"{stats['prompt_tokens']} + {stats['completion_tokens']}")
+        st.metric("Estimated cost", f"${stats['cost']:.4f}")
+        st.table([{"stage": stage, "count": times["count"], "p50 ms": round(times["p50_seconds"] * 1000, 1),
+                   "p95 ms": round(times["p95_seconds"] * 1000, 1)}
+                  for stage, times in stats["stages"].items()])
 
 
-# Function to collect the 'Yes' or 'No' feedback separately
-def collect_liked_feedback():
-    liked_response = st.selectbox("did you  like the response",["yes","no"])
-    
-    return liked_response
 # Streamlit Interface
+# The inquiry is entered in a form (typing does not rerun the script), the generated emails are kept in
+# st.session_state, so later reruns (feedback, other widgets) show them again without calling the model.
 def run():
+    start_process_exporter()  # METRICS_PORT / METRICS_FILE, once per process
+    start_job_workers()  # emails queued while the service was busy, also by earlier runs
     st.title('Hemanth\'s Smart Email Response Generator')
     # Prefilled values
     prefilled_values = {
@@ -133,52 +201,66 @@ def run():
     }
 
     # Collecting input data from the user and setting prefilled values
-    your_name = st.text_input("Your Name", value=prefilled_values["your_name"])
-    client_first_name = st.text_input("Client First Name", value=prefilled_values["client_first_name"])
-    client_last_name = st.text_input("Client Last Name", value=prefilled_values["client_last_name"])
-    client_email = st.text_input("Client Email", value=prefilled_values["client_email"])
-    client_website=st.text_input("Enter the prefered client website", prefilled_values["client_website"])
-    client_country = st.text_input("Client Country", value=prefilled_values["client_country"])
-    client_language = st.selectbox("Client Language", ["English", "Spanish", "French", "German", "Italian", "Portuguese"])
-    project_type = st.text_input("Project Type", value=prefilled_values["project_type"])
-    service_category = st.text_input("Service Category", value=prefilled_values["service_category"])
-    project_details = st.text_area("Project Details", value=prefilled_values["project_details"])
-    budget = st.text_input("Budget", value=prefilled_values["budget"])
-    # Button to generate the email
-    if st.button("Generate Email Response"):
-        if all([your_name, client_first_name, client_last_name, client_email, client_country, client_website ,client_language,
-                project_type, service_category, project_details, budget]):
-            # Generate the email response
-            email_response = generate_email_response(
-                client_first_name, client_last_name, client_email, client_country, client_website,client_language,
-                project_type, service_category, project_details, budget, your_name
-            )
-            # Display the generated email response
-            st.subheader("Generated Email Response:")
-            st.text_area("Email Response", email_response, height=250, key="email_response_area")
-
-            # Collect feedback for "Did you like the response?"
-            liked_response = collect_liked_feedback()
-
-            # Collect suggestions for improvement
-            collect_feedback(your_name, client_first_name, client_last_name, client_email, email_response)
-            feed1=" it was good"
-            # Store the liked/disliked feedback separately
-            feedback_data = {
-
-                "your_name": your_name,
-                "client_first_name": client_first_name,
-                "client_last_name": client_last_name,
-                "client_email": client_email,
-                "liked_response": liked_response,  # Storing whether they liked the response
-                "feedback":feed1
-
-            }
-            store_feedback(feedback_data)
+    with st.form("inquiry_form"):
+        your_name = st.text_input("Your Name", value=prefilled_values["your_name"])
+        client_first_name = st.text_input("Client First Name", value=prefilled_values["client_first_name"])
+        client_last_name = st.text_input("Client Last Name", value=prefilled_values["client_last_name"])
+        client_email = st.text_input("Client Email", value=prefilled_values["client_email"])
+        client_website=st.text_input("Enter the prefered client website", prefilled_values["client_website"])
+        client_country = st.text_input("Client Country", value=prefilled_values["client_country"])
+        # Choosing several languages writes the email in all of them at once
+        client_languages = st.multiselect("Client Language", LANGUAGES, default=[prefilled_values["client_language"]])
+        project_type = st.text_input("Project Type", value=prefilled_values["project_type"])
+        service_category = st.text_input("Service Category", value=prefilled_values["service_category"])
+        project_details = st.text_area("Project Details", value=prefilled_values["project_details"])
+        budget = st.text_input("Budget", value=prefilled_values["budget"])
+        # More than one version costs one model call too; the others are offered when the first one is not liked
+        versions = st.number_input("Versions to choose from", min_value=1, max_value=MAX_CANDIDATES, value=1)
+        # Button to generate the email, "Regenerate" skips the cached response for the same inquiry
+        generate_clicked = st.form_submit_button("Generate Email Response")
+        regenerate_clicked = st.form_submit_button("Regenerate Email Response")
 
+    if generate_clicked or regenerate_clicked:
+        if all([your_name, client_first_name, client_last_name, client_email, client_country, client_website ,client_languages,
+                project_type, service_category, project_details, budget]):
+            inquiry = build_inquiry(client_first_name, client_last_name, client_email, client_country, client_website,
+                                    client_languages[0], project_type, service_category, project_details, budget, your_name)
+            if len(client_languages) > 1 or versions > 1:
+                variants = show_language_variants(inquiry, client_languages, regenerate_clicked, candidates=versions)
+            else:
+                # A liked reply to a near-identical inquiry is shown at once; "Regenerate" always asks the model
+                started = time.perf_counter()
+                reusable, similarity, examples = find_similar_replies(inquiry)
+                if reusable is not None and not regenerate_clicked:
+                    email_response = reusable
+                    get_metrics().record_request(MODEL, time.perf_counter() - started, "success", "reused")
+                else:
+                    similarity = 0.0
+                    email_response, error = show_streamed_response(inquiry, use_cache=not regenerate_clicked,
+                                                                   examples=examples)
+                if email_response is not None:
+                    variants = [new_variant(inquiry, email_response, similarity)]
+                elif isinstance(error, BUSY_ERRORS):
+                    variants = [queue_variant(inquiry, use_cache=not regenerate_clicked)]
+                else:
+                    variants = []
+            if variants:
+                # Keep the result for the following reruns; a new id gives the new emails fresh widgets
+                generation_id = st.session_state.get("generation_id", 0) + 1
+                st.session_state["generation_id"] = generation_id
+                st.session_state["generation"] = {"id": generation_id, "variants": variants}
         else:
             st.warning("Please fill in all the fields.")
 
+    generation = st.session_state.get("generation")
+    if generation is not None:
+        # Display the generated email responses, one per language
+        st.subheader("Generated Email Response:")
+        for variant in generation["variants"]:
+            show_variant(generation, variant, multiple=len(generation["variants"]) > 1)
+
+    show_stats_panel()
+
 # Run the Streamlit app
 if __name__ == "__main__":
     run()
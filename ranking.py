@@ -0,0 +1,63 @@
+import re  # splitting a body into words
+
+import numpy as np  # similarity to liked replies
+
+from similarity_index import embed  # same hashed n-gram vectors as the liked-reply index
+
+# Candidates are email bodies, before the subject, salutation, website line and signature of the template are added
+# (those are the same for every candidate). Weight of every check in the score (the score is between 0 and 1).
+WEIGHTS = {"language": 0.5, "length": 0.3, "history": 0.2}
+
+# A body with fewer words than this is probably cut off or empty; it gets a proportionally lower "length" score
+MIN_BODY_WORDS = 40
+
+# Frequent short words of every language of the app, to recognise the language a reply is written in
+STOPWORDS = {
+    "english": {"the", "and", "to", "of", "we", "you", "your", "for", "with", "is", "are", "our", "this", "will"},
+    "spanish": {"el", "la", "de", "que", "y", "en", "los", "para", "con", "su", "por", "una", "nuestro", "usted"},
+    "french": {"le", "la", "de", "et", "les", "des", "pour", "vous", "votre", "nous", "une", "avec", "est", "dans"},
+    "german": {"der", "die", "das", "und", "zu", "wir", "sie", "ihr", "ihre", "mit", "für", "ist", "den", "ein"},
+    "italian": {"il", "di", "che", "e", "la", "per", "un", "una", "con", "del", "vostro", "suo", "siamo", "sono"},
+    "portuguese": {"o", "de", "que", "e", "do", "da", "para", "com", "um", "uma", "seu", "sua", "os", "nosso"},
+}
+
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+
+# Function to find the language (a key of STOPWORDS) most of the text's frequent words belong to, or None
+def detect_language(text):
+    words = _WORDS.findall(text.lower())
+    counts = {language: sum(1 for word in words if word in stopwords) for language, stopwords in STOPWORDS.items()}
+    language, hits = max(counts.items(), key=lambda item: item[1])
+    return language if hits else None
+
+
+# Function to check one candidate body: returns {check name: 0..1}. liked_vectors are embeddings of the bodies of
+# liked replies to similar inquiries (see similarity_index.py), compared with the candidate for the "history" check.
+def check_candidate(body, inquiry, liked_vectors=None):
+    text = body.strip()
+
+    target = str(inquiry.get("client_language") or "").strip().lower()
+    detected = detect_language(text)
+    language = 1.0 if detected == target or (detected is None and target not in STOPWORDS) else 0.0
+
+    length = min(1.0, len(_WORDS.findall(text)) / MIN_BODY_WORDS)
+
+    history = 0.0
+    if text and liked_vectors is not None and len(liked_vectors):
+        history = max(0.0, float(np.max(np.asarray(liked_vectors) @ embed(text))))
+
+    return {"language": language, "length": round(length, 4), "history": history}
+
+
+# Function to order candidate bodies best first: returns [(score, checks, body)]. Ties keep the order the model
+# returned them in.
+def rank_candidates(candidates, inquiry, liked_bodies=()):
+    liked_vectors = [embed(body) for body in liked_bodies] or None
+    ranked = []
+    for position, body in enumerate(candidates):
+        checks = check_candidate(body, inquiry, liked_vectors)
+        score = sum(WEIGHTS[name] * value for name, value in checks.items())
+        ranked.append((round(score, 4), -position, checks, body))
+    ranked.sort(key=lambda item: item[:2], reverse=True)
+    return [(score, checks, body) for score, _, checks, body in ranked]
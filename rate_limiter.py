@@ -0,0 +1,123 @@
+import os  # reading the quota from the environment
+import random  # jitter for the retry delays
+import threading  # the limiter is shared by every Streamlit session and batch worker of the process
+import time  # waiting for the buckets to refill
+
+# Quota of the OpenAI account, requests per minute and tokens per minute
+REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "60"))
+TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "90000"))
+
+# Retry settings for transient errors
+MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "5"))
+BASE_DELAY = 1.0  # seconds before the first retry, doubled after every failed attempt
+MAX_DELAY = 30.0  # upper bound for one retry delay
+MAX_WAIT = 60.0  # longest a caller waits for its turn before giving up
+
+
+# Raised when a caller would have to wait longer than max_wait for the quota
+class RateLimitTimeout(Exception):
+    pass
+
+
+# Token bucket refilled continuously at per_minute / 60 units per second. Callers reserve units up front,
+# which may drive the bucket below zero; the deficit is how long they have to wait, so waiting callers
+# are spread out evenly instead of all retrying at the same moment.
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        # By default at most six seconds worth of quota can be spent in one burst
+        self.capacity = capacity if capacity is not None else max(1.0, per_minute / 10.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    # Seconds until `amount` units would be available (the caller holds the limiter lock)
+    def wait_time(self, amount, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+# Limiter for both requests per minute and tokens per minute, plus a shared pause after the API reports a 429
+class RateLimiter:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Wait until one request of about `estimated_tokens` tokens fits into the quota
+    def acquire(self, estimated_tokens, max_wait=MAX_WAIT):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(estimated_tokens, now),
+                       self.paused_until - now)
+            if wait > max_wait:
+                raise RateLimitTimeout(f"the request quota is exhausted for the next {wait:.0f} seconds")
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    # Correct the token bucket once the real usage of a request is known
+    def settle(self, estimated_tokens, actual_tokens):
+        with self._lock:
+            self.tokens.give_back(estimated_tokens - actual_tokens)
+
+    # Make every caller wait `seconds` (used when the API answers with a rate limit error anyway)
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+# Function to compute the delay before retry number `attempt` (1-based): exponential backoff with full jitter,
+# or the server's Retry-After header when it sent one
+def retry_delay(attempt, error=None, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("retry-after") if hasattr(headers, "get") else None
+    if retry_after:
+        try:
+            return min(max_delay, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+# Function to call fn() under the limiter, retrying transient errors. Returns (value, attempts);
+# the last error is raised when the call fails permanently or runs out of attempts.
+def call_with_retries(fn, is_transient, limiter, estimated_tokens, max_attempts=MAX_ATTEMPTS, is_rate_limit=None):
+    attempt = 0
+    while True:
+        attempt += 1
+        limiter.acquire(estimated_tokens)
+        try:
+            return fn(), attempt
+        except Exception as e:
+            if attempt >= max_attempts or not is_transient(e):
+                e.attempts = attempt
+                raise
+            delay = retry_delay(attempt, e)
+            if is_rate_limit is not None and is_rate_limit(e):
+                # Everybody backs off, not just this caller, so the quota can recover
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+# Shared limiter for the whole process
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
@@ -3,14 +3,16 @@ import os
 import streamlit as st
 from dotenv import load_dotenv
 
-# Load environment variables from the .env file
+# Load environment variables from the .env file, before the modules below read their settings
 load_dotenv()
 
+from llm_backend import get_backend
+
 # Retrieve the API key from the environment
 my_key = os.getenv("MY_KEY")
 
-# Set your OpenAI API key
-openai.api_key = my_key
+# Model backend using your OpenAI API key (LLM_BACKEND=fake for the local fake)
+chat_api = get_backend(my_key)
 
 # Function to generate the email response using chat models (gpt-3.5-turbo or gpt-4)
 def generate_email_response(client_first_name, client_last_name, client_email, client_country, client_language, 
@@ -34,8 +36,8 @@ def generate_email_response(client_first_name, client_last_name, client_email, c
 
     # Try to make the API call to OpenAI
     try:
-        # Using openai.ChatCompletion.create() for chat models like gpt-3.5-turbo
-        response = openai.ChatCompletion.create(
+        # Using the backend create() (same arguments as openai.ChatCompletion.create()) for chat models like gpt-3.5-turbo
+        response = chat_api.create(
             model="gpt-3.5-turbo",  # Make sure to use the correct model
             messages=[{"role": "user", "content": prompt}],
             max_tokens=300,
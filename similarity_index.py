@@ -0,0 +1,218 @@
+import argparse  # command line rebuild
+import hashlib  # de-duplicating entries
+import json  # entry metadata, one JSON line per row of the matrix
+import os  # index files
+import re  # splitting text into words
+import sys  # exit code
+import threading  # the index is shared by every Streamlit session of the process
+import zlib  # stable feature hashing (Python's hash() changes between processes)
+
+import numpy as np  # vectorised similarity search
+from dotenv import load_dotenv  # settings from the .env file, like the app
+
+# SIMILARITY_INDEX_DIR and FEEDBACK_DIR may be set in .env, also for `python similarity_index.py rebuild`
+load_dotenv()
+
+from feedback_store import FileLock, get_store
+
+INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", "similarity_index")
+DIMENSIONS = 1024  # width of the hashed feature vectors
+
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+
+# Function to describe an inquiry as the text that decides whether two inquiries are alike
+def inquiry_text(inquiry):
+    return " ".join(str(inquiry.get(name) or "") for name in ("project_type", "service_category", "project_details"))
+
+
+# Function to turn text into a hashed n-gram vector: words, word pairs and character trigrams are hashed
+# (signed) into DIMENSIONS buckets, counts are dampened with log(1 + n) and the vector is L2-normalised,
+# so the dot product of two vectors is their cosine similarity
+def embed(text, dimensions=DIMENSIONS):
+    words = _WORDS.findall(text.lower())
+    features = list(words)
+    features += [a + " " + b for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        features += ["#" + padded[i:i + 3] for i in range(len(padded) - 2)]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    if not features:
+        return vector
+    hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in features), dtype=np.uint64,
+                         count=len(features))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, (hashes % dimensions).astype(np.intp), signs)
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# Fields a reply confirms to the client that the similarity text leaves out; a stored reply is only reused as it is
+# when they are the same (otherwise it can still serve as an example)
+REUSE_FIELDS = ("budget", "client_country")
+
+
+# Function to check whether a reply stored for entry_inquiry may be reused for inquiry (see REUSE_FIELDS)
+def can_reuse(entry_inquiry, inquiry):
+    return all(" ".join(str(entry_inquiry.get(name) or "").lower().split())
+               == " ".join(str(inquiry.get(name) or "").lower().split()) for name in REUSE_FIELDS)
+
+
+# Function to reuse a stored reply for another client: the old names and website are replaced by the new ones
+def adapt_reply(entry_inquiry, email_response, inquiry):
+    for name in ("your_name", "client_first_name", "client_last_name", "client_website"):
+        old, new = str(entry_inquiry.get(name) or ""), str(inquiry.get(name) or "")
+        if old and new and old != new:
+            # whole words only, so replacing a short name does not change other words containing it
+            email_response = re.sub(r"(?<!\w)" + re.escape(old) + r"(?!\w)", lambda match: new, email_response)
+    return email_response
+
+
+# Similarity index over liked replies: a float32 matrix with one row per reply (vectors.f32) and the inquiry, reply
+# and row number of every reply (entries.jsonl). Both files are only appended to, under a file lock, so adding a
+# reply costs the same however big the index is, and other processes pick up new rows on their next search.
+class SimilarityIndex:
+    def __init__(self, directory=INDEX_DIR, dimensions=DIMENSIONS):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.row_bytes = dimensions * 4
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.entries_path = os.path.join(directory, "entries.jsonl")
+        self.lock_path = os.path.join(directory, ".lock")
+
+        self._matrix = np.zeros((64, dimensions), dtype=np.float32)  # grown by doubling
+        self._languages = np.empty(64, dtype=object)
+        self._entries = []
+        self._keys = set()
+        self._entries_read = 0  # bytes of entries.jsonl already loaded
+        self._lock = threading.Lock()
+        with self._lock, FileLock(self.lock_path):
+            self._refresh_locked()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Add a liked reply; returns False when the same reply for the same inquiry is already indexed
+    def add(self, inquiry, email_response):
+        inquiry = {name: str(value) for name, value in inquiry.items()}
+        key = hashlib.sha256(json.dumps([inquiry_text(inquiry), email_response]).encode("utf-8")).hexdigest()
+        vector = embed(inquiry_text(inquiry), self.dimensions)
+        with self._lock, FileLock(self.lock_path):
+            self._refresh_locked()
+            if key in self._keys:
+                return False
+            # The vector is written before its entry, so every entry points at a complete row even after a crash
+            size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            row = size // self.row_bytes
+            if size % self.row_bytes:
+                os.truncate(self.vectors_path, row * self.row_bytes)  # a row cut short by a crash
+            with open(self.vectors_path, "ab") as file:
+                file.write(vector.tobytes())
+            entry = {"key": key, "row": row, "inquiry": inquiry, "email_response": email_response}
+            with open(self.entries_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._refresh_locked()
+        return True
+
+    # The k most similar indexed replies in the same language as the inquiry, as (similarity, entry), best first
+    def search(self, inquiry, k=3):
+        with self._lock:
+            if os.path.exists(self.entries_path) and os.path.getsize(self.entries_path) > self._entries_read:
+                with FileLock(self.lock_path):
+                    self._refresh_locked()
+            count = len(self._entries)
+            if count == 0:
+                return []
+            vector = embed(inquiry_text(inquiry), self.dimensions)
+            scores = self._matrix[:count] @ vector
+            language = str(inquiry.get("client_language") or "").strip().lower()
+            scores[self._languages[:count] != language] = -1.0
+            k = min(k, count)
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [(float(scores[i]), self._entries[i]) for i in best if scores[i] > 0]
+
+    # Load the entries appended since the last refresh and their rows (the caller holds both locks)
+    def _refresh_locked(self):
+        if not os.path.exists(self.entries_path):
+            return
+        new_entries = []
+        with open(self.entries_path, "rb") as file:
+            file.seek(self._entries_read)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # an entry cut short by a crash
+                self._entries_read += len(line)
+                try:
+                    new_entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        if not new_entries:
+            return
+
+        first_row = min(entry["row"] for entry in new_entries)
+        last_row = max(entry["row"] for entry in new_entries)
+        with open(self.vectors_path, "rb") as file:
+            file.seek(first_row * self.row_bytes)
+            data = file.read((last_row - first_row + 1) * self.row_bytes)
+        rows = np.frombuffer(data, dtype=np.float32).reshape(-1, self.dimensions)
+
+        start = len(self._entries)
+        needed = start + len(new_entries)
+        if needed > len(self._matrix):
+            capacity = max(needed, 2 * len(self._matrix))
+            matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            matrix[:start] = self._matrix[:start]
+            languages = np.empty(capacity, dtype=object)
+            languages[:start] = self._languages[:start]
+            self._matrix, self._languages = matrix, languages
+        for position, entry in enumerate(new_entries, start):
+            self._matrix[position] = rows[entry["row"] - first_row]
+            self._languages[position] = str(entry["inquiry"].get("client_language") or "").strip().lower()
+            self._entries.append(entry)
+            self._keys.add(entry["key"])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Shared index for the whole process
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex()
+        return _index
+
+
+# Function to add every liked reply in the feedback log to the index (replies already indexed are skipped)
+def rebuild_from_feedback(index, records):
+    added = 0
+    for record in records:
+        if str(record.get("liked_response") or "").strip().lower() != "yes":
+            continue
+        if not record.get("email_response") or not record.get("project_details"):
+            continue
+        inquiry = {name: value for name, value in record.items()
+                   if name.startswith("client_") or name in ("project_type", "service_category", "project_details",
+                                                            "budget", "your_name")}
+        if index.add(inquiry, record["email_response"]):
+            added += 1
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the liked replies of the feedback log.")
+    parser.add_argument("command", choices=["rebuild"], help="add every liked reply of the feedback log")
+    parser.parse_args(argv)
+    index = get_index()
+    added = rebuild_from_feedback(index, get_store().iter_records())
+    print(f"{added} replies added, {len(index)} in the index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
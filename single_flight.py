@@ -0,0 +1,130 @@
+import os  # lock folder for the multi-process variant
+import threading  # callers waiting for the same generation
+from concurrent.futures import Future  # result shared by all callers of one key
+from contextlib import nullcontext  # no cross-process lock when it is not configured
+
+from feedback_store import FileLock  # same file lock as the feedback log
+
+# Folder of the cross-process locks; empty (default) coalesces within one process only. Keys are spread over
+# 256 lock files, so two different inquiries now and then wait for each other but the folder never grows.
+SINGLE_FLIGHT_DIR = os.getenv("SINGLE_FLIGHT_DIR", "")
+
+
+# Chunks of one streamed generation, replayed to every caller that joins it (also after it has started)
+class _Broadcast:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def publish(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def follow(self):
+        position = 0
+        while True:
+            with self.condition:
+                while position >= len(self.chunks) and not self.done:
+                    self.condition.wait()
+                if position >= len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+                chunk = self.chunks[position]
+            position += 1
+            yield chunk
+
+
+# Single-flight coalescing: while a call for a key is running, further calls for the same key do not start their
+# own but wait for it and receive its result (or its exception). Threads call do() / stream(); async code runs
+# them on an executor like the rest of the generation core. Keys are forgotten as soon as their call finishes,
+# nothing is cached here.
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future (do) or _Broadcast (stream)
+
+    # Run fn() once for all concurrent callers of key. Returns (result, leader): leader is True for the caller
+    # that actually ran fn
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(("do", key))
+            leader = future is None
+            if leader:
+                future = self._calls[("do", key)] = Future()
+        if not leader:
+            return future.result(), False
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[("do", key)]
+        return future.result(), True
+
+    # Iterate fn() once for all concurrent callers of key. Returns (chunks, leader); every caller gets every chunk,
+    # the followers as fast as the leader consumes them. If the leader stops early the followers get an error.
+    def stream(self, key, fn):
+        with self._lock:
+            broadcast = self._calls.get(("stream", key))
+            leader = broadcast is None
+            if leader:
+                broadcast = self._calls[("stream", key)] = _Broadcast()
+        if not leader:
+            return broadcast.follow(), False
+        return self._lead(key, broadcast, fn), True
+
+    def _lead(self, key, broadcast, fn):
+        error = RuntimeError("the shared generation was stopped before it finished")
+        try:
+            for chunk in fn():
+                broadcast.publish(chunk)
+                yield chunk
+            error = None
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[("stream", key)]
+            broadcast.finish(error)
+
+    # Number of keys in flight right now
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
+
+
+_flights = None
+_flights_lock = threading.Lock()
+
+
+# Shared registry for the whole process: identical inquiries requested at the same time (a double click, several
+# sessions opening the same lead) share one generation. Streamlit re-runs the app script on every interaction, so
+# the registry must live here and not in the script.
+def get_flights():
+    global _flights
+    with _flights_lock:
+        if _flights is None:
+            _flights = SingleFlight()
+        return _flights
+
+
+# Function to lock key across processes (when SINGLE_FLIGHT_DIR is set): the second process waits until the first
+# has finished, then finds the result in the shared response cache instead of generating it again
+def process_lock(key, directory=None):
+    directory = SINGLE_FLIGHT_DIR if directory is None else directory
+    if not directory:
+        return nullcontext()
+    os.makedirs(directory, exist_ok=True)
+    return FileLock(os.path.join(directory, f"{key[:2]}.lock"))
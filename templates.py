@@ -0,0 +1,149 @@
+import re  # recognising greetings and sign-offs the model writes anyway
+from string import Template  # per-language email templates
+
+# Parts of the email that do not need the model, per language: subject line, salutation, website reference and
+# signature. The signature keeps the "best regards from" phrase the emails have always ended with.
+TEMPLATES = {
+    "english": {
+        "subject": "Subject: Your $project_type project ($service_category)",
+        "salutation": "Dear $client_first_name,",
+        "website": "I have also taken a look at $client_website, which will help us shape the proposal.",
+        "signature": "Best regards from $your_name",
+    },
+    "spanish": {
+        "subject": "Asunto: Su proyecto de $project_type ($service_category)",
+        "salutation": "Estimado/a $client_first_name:",
+        "website": "También he revisado $client_website, lo que nos ayudará a preparar la propuesta.",
+        "signature": "Best regards from $your_name",
+    },
+    "french": {
+        "subject": "Objet : Votre projet $project_type ($service_category)",
+        "salutation": "Bonjour $client_first_name,",
+        "website": "J'ai également consulté $client_website, ce qui nous aidera à préparer la proposition.",
+        "signature": "Best regards from $your_name",
+    },
+    "german": {
+        "subject": "Betreff: Ihr Projekt $project_type ($service_category)",
+        "salutation": "Hallo $client_first_name,",
+        "website": "Ich habe mir außerdem $client_website angesehen, das hilft uns beim Angebot.",
+        "signature": "Best regards from $your_name",
+    },
+    "italian": {
+        "subject": "Oggetto: Il suo progetto $project_type ($service_category)",
+        "salutation": "Gentile $client_first_name,",
+        "website": "Ho anche dato un'occhiata a $client_website, che ci aiuterà a preparare la proposta.",
+        "signature": "Best regards from $your_name",
+    },
+    "portuguese": {
+        "subject": "Assunto: O seu projeto $project_type ($service_category)",
+        "salutation": "Olá $client_first_name,",
+        "website": "Também analisei $client_website, o que nos ajudará a preparar a proposta.",
+        "signature": "Best regards from $your_name",
+    },
+}
+DEFAULT_LANGUAGE = "english"  # skeleton for languages without a template; the body is still in the asked language
+
+# Templates compiled once at import, not on every request
+_COMPILED = {language: {part: Template(text) for part, text in parts.items()} for language, parts in TEMPLATES.items()}
+
+# A first line that is a subject or a greeting (at most HEAD_LINE_MAX characters), and a line that starts a sign-off,
+# in the languages of the app
+HEAD_LINE_MAX = 120
+_HEAD_LINE = re.compile(
+    r"^\W*(subject|asunto|objet|betreff|oggetto|assunto)\b[^\n]{0,100}$"
+    r"|^\W*(dear|hi|hello|estimad[oa]s?|hola|bonjour|cher|chère|hallo|sehr geehrte[rs]?|liebe[rs]?|gentile|"
+    r"car[oa]|olá|prezad[oa])\b[^\n]{0,60}[,:!]?\s*$",
+    re.IGNORECASE,
+)
+_CLOSING_LINE = re.compile(
+    r"^\W*(best|kind|warm)?\s*(regards|wishes)\b|^\W*(sincerely|thanks|thank you|saludos|atentamente|cordialement|"
+    r"bien à vous|mit freundlichen grüßen|viele grüße|beste grüße|cordiali saluti|distinti saluti|atenciosamente|"
+    r"cumprimentos|un saludo)\W*",
+    re.IGNORECASE,
+)
+
+
+def _parts(inquiry):
+    language = str(inquiry.get("client_language") or "").strip().lower()
+    return _COMPILED.get(language, _COMPILED[DEFAULT_LANGUAGE])
+
+
+# Function to render the parts of the email before and after the body
+def render_frame(inquiry):
+    parts = _parts(inquiry)
+    values = {name: str(value).strip() for name, value in inquiry.items()}
+    head = parts["subject"].safe_substitute(values) + "\n\n" + parts["salutation"].safe_substitute(values) + "\n\n"
+    tail = "\n\n" + parts["website"].safe_substitute(values) + "\n\n" + parts["signature"].safe_substitute(values)
+    return head, tail
+
+
+# Function to drop what the model wrote despite being asked for the body only: a subject or greeting at the start
+def strip_head(text):
+    text = text.lstrip()
+    while text and _HEAD_LINE.match(text.split("\n", 1)[0].strip()):
+        text = text.split("\n", 1)[1].lstrip() if "\n" in text else ""
+    return text
+
+
+# Where the last two paragraphs of text start; a sign-off is only looked for there
+def _tail_start(text):
+    cut = text.rfind("\n\n")
+    cut = text.rfind("\n\n", 0, cut) if cut > 0 else -1
+    return max(cut, 0)
+
+
+# ... and a sign-off (with the name under it) in the last two paragraphs
+def strip_tail(text):
+    start = _tail_start(text)
+    lines = text[start:].split("\n")
+    for index, line in enumerate(lines):
+        if len(line.strip()) <= 40 and _CLOSING_LINE.match(line.strip()):  # a sign-off, not a "thank you" sentence
+            del lines[index:]
+            break
+    return (text[:start] + "\n".join(lines)).rstrip()
+
+
+# Function to clean the body written by the model; returns "" when nothing usable is left
+def clean_body(text):
+    return strip_tail(strip_head(text)).strip()
+
+
+# Function to put the email together: subject, salutation, the model's body, website reference and signature
+def assemble_email(inquiry, body):
+    head, tail = render_frame(inquiry)
+    return head + clean_body(body) + tail
+
+
+# Cleans a streamed body on the fly: the start is held back until its first line is complete (to drop a greeting),
+# and the last two paragraphs are held back until the stream ends (to drop a sign-off). The concatenation of
+# everything returned by feed() and finish() is clean_body() of the whole body.
+class BodyStream:
+    def __init__(self):
+        self.buffer = ""
+        self.started = False
+
+    def feed(self, text):
+        self.buffer += text
+        while not self.started:
+            self.buffer = self.buffer.lstrip()
+            if "\n" not in self.buffer:
+                if len(self.buffer) <= HEAD_LINE_MAX:
+                    return ""  # the first line is not complete yet and could still be a greeting
+                self.started = True
+                break
+            first, rest = self.buffer.split("\n", 1)
+            if not _HEAD_LINE.match(first.strip()):
+                self.started = True
+            else:
+                self.buffer = rest
+        # trailing blank lines stay in the buffer too, the end of the body is stripped
+        cut = len(self.buffer[:_tail_start(self.buffer)].rstrip())
+        if cut <= 0:
+            return ""
+        ready, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return ready
+
+    def finish(self):
+        text, self.buffer = self.buffer, ""
+        text = strip_tail(text if self.started else strip_head(text))
+        return text if self.started else text.strip()
@@ -0,0 +1,181 @@
+import json  # one usage record per line
+import math  # rounding token estimates up
+import os  # reading the budget settings from the environment
+import re  # splitting text into word pieces for the fallback tokenizer
+import threading  # usage records are written from several sessions at once
+import time  # timestamps of usage records
+
+try:
+    import tiktoken  # exact OpenAI tokenizer, optional
+except ImportError:
+    tiktoken = None
+
+# Context window of the models we use; prompt + completion must fit into it
+MODEL_CONTEXT_TOKENS = {"gpt-3.5-turbo": 4096, "gpt-4": 8192}
+DEFAULT_CONTEXT_TOKENS = 4096
+
+# Bounds for the completion budget (max_tokens); the model only writes the body of the email (see templates.py)
+MIN_COMPLETION_TOKENS = 120
+MAX_COMPLETION_TOKENS = int(os.getenv("MAX_COMPLETION_TOKENS", "400"))
+
+# Replies in these languages need more tokens than the same email in English
+LANGUAGE_TOKEN_FACTOR = {
+    "english": 1.0,
+    "spanish": 1.25,
+    "french": 1.25,
+    "italian": 1.25,
+    "portuguese": 1.25,
+    "german": 1.3,
+}
+OTHER_LANGUAGE_TOKEN_FACTOR = 1.5
+
+# Per-field policy: (maximum tokens, how to shorten a longer value)
+# "truncate" keeps the beginning, "head_tail" keeps the beginning and the end of a long brief
+FIELD_POLICY = {
+    "project_details": (int(os.getenv("PROJECT_DETAILS_MAX_TOKENS", "600")), "head_tail"),
+    "client_website": (40, "truncate"),
+    "budget": (20, "truncate"),
+}
+DEFAULT_FIELD_POLICY = (30, "truncate")
+
+USAGE_LOG_PATH = os.getenv("TOKEN_USAGE_LOG", "token_usage.jsonl")
+
+_WORD_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_encodings = {}
+
+
+# Function to count the tokens of text for a model: tiktoken when it is installed, otherwise an estimate of one
+# token per punctuation mark and one per started group of four characters of every word
+def count_tokens(text, model="gpt-3.5-turbo"):
+    if tiktoken is not None:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _encodings[model] = encoding
+        return len(encoding.encode(text))
+    return sum(math.ceil(len(piece) / 4) for piece in _WORD_PIECES.findall(text))
+
+
+# Function to shorten text to at most max_tokens, keeping whole words
+def trim_text(text, max_tokens, strategy="truncate", model="gpt-3.5-turbo"):
+    text = " ".join(text.split())  # repeated blanks and line breaks cost tokens too
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    words = text.split(" ")
+    marker = " [...] "
+    budget = max_tokens - count_tokens(marker, model)
+    if strategy == "head_tail":
+        head = _take_words(words, budget * 2 // 3, model)
+        tail = _take_words(list(reversed(words[len(head):])), budget - budget * 2 // 3, model)
+        return " ".join(head) + marker + " ".join(reversed(tail))
+    return " ".join(_take_words(words, budget, model)) + marker.rstrip()
+
+
+def _take_words(words, max_tokens, model):
+    taken = []
+    used = 0
+    for word in words:
+        cost = count_tokens(" " + word, model)
+        if used + cost > max_tokens:
+            break
+        taken.append(word)
+        used += cost
+    return taken
+
+
+# Function to pick max_tokens for the reply from the size of the brief and the reply language
+def choose_max_tokens(details_tokens, language):
+    factor = LANGUAGE_TOKEN_FACTOR.get(str(language).strip().lower(), OTHER_LANGUAGE_TOKEN_FACTOR)
+    wanted = (160 + details_tokens // 4) * factor
+    return int(min(MAX_COMPLETION_TOKENS, max(MIN_COMPLETION_TOKENS, wanted)))
+
+
+# Token plan of one request: the (possibly shortened) inquiry, its prompt, the projected prompt tokens,
+# the max_tokens to ask for and the names of the fields that were shortened
+class TokenBudget:
+    def __init__(self, inquiry, prompt, prompt_tokens, max_tokens, trimmed_fields):
+        self.inquiry = inquiry
+        self.prompt = prompt
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.trimmed_fields = trimmed_fields
+
+
+# Inquiry fields shortened according to FIELD_POLICY. They do not depend on the reply language, so they are
+# prepared once and shared by all language variants of one inquiry.
+class PreparedFields:
+    def __init__(self, fields, trimmed_fields, details_tokens):
+        self.fields = fields
+        self.trimmed_fields = trimmed_fields
+        self.details_tokens = details_tokens
+
+
+# Function to shorten every field of an inquiry according to FIELD_POLICY
+def prepare_fields(inquiry, model="gpt-3.5-turbo"):
+    fields = {}
+    trimmed_fields = []
+    for name, value in inquiry.items():
+        max_field_tokens, strategy = FIELD_POLICY.get(name, DEFAULT_FIELD_POLICY)
+        fields[name] = trim_text(str(value), max_field_tokens, strategy, model)
+        if fields[name] != " ".join(str(value).split()):
+            trimmed_fields.append(name)
+    details_tokens = count_tokens(fields.get("project_details", ""), model)
+    return PreparedFields(fields, trimmed_fields, details_tokens)
+
+
+# Function to fit an inquiry into the budget: every field is shortened according to FIELD_POLICY (or taken from
+# `prepared`), max_tokens is chosen from the brief and the language, and the brief is shortened further if
+# prompt + reply would not fit the model's context. build_prompt(**inquiry) builds the prompt text.
+def plan_budget(inquiry, build_prompt, model="gpt-3.5-turbo", prepared=None):
+    if prepared is None:
+        prepared = prepare_fields(inquiry, model)
+    trimmed = dict(prepared.fields)
+    trimmed_fields = list(prepared.trimmed_fields)
+    details_tokens = prepared.details_tokens
+    if "client_language" in inquiry:
+        # the reply language is the one field that differs between the variants sharing `prepared`
+        max_field_tokens, strategy = FIELD_POLICY.get("client_language", DEFAULT_FIELD_POLICY)
+        trimmed["client_language"] = trim_text(str(inquiry["client_language"]), max_field_tokens, strategy, model)
+
+    max_tokens = choose_max_tokens(details_tokens, trimmed.get("client_language", "English"))
+    prompt = build_prompt(**trimmed)
+    prompt_tokens = count_tokens(prompt, model)
+
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    overflow = prompt_tokens + max_tokens - context
+    if overflow > 0 and "project_details" in trimmed:
+        trimmed["project_details"] = trim_text(trimmed["project_details"], max(0, details_tokens - overflow),
+                                               "head_tail", model)
+        if "project_details" not in trimmed_fields:
+            trimmed_fields.append("project_details")
+        prompt = build_prompt(**trimmed)
+        prompt_tokens = count_tokens(prompt, model)
+
+    return TokenBudget(trimmed, prompt, prompt_tokens, max_tokens, trimmed_fields)
+
+
+_usage_lock = threading.Lock()
+
+
+# Function to record the projected and the actual token counts of one request in the usage log
+# (actual_prompt_tokens is None for streamed replies, the API does not report usage for them)
+def record_usage(budget, model, actual_prompt_tokens, actual_completion_tokens, path=None):
+    record = {
+        "time": time.time(),
+        "model": model,
+        "projected_prompt_tokens": budget.prompt_tokens,
+        "max_tokens": budget.max_tokens,
+        "actual_prompt_tokens": actual_prompt_tokens,
+        "actual_completion_tokens": actual_completion_tokens,
+        "trimmed_fields": budget.trimmed_fields,
+    }
+    path = path or USAGE_LOG_PATH
+    if not path:
+        return record
+    with _usage_lock:
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+    return record